@@ -0,0 +1,77 @@
+"""
+Add the Redis bearer tokens issued before the per-user tokens index to the index, so that
+revoking all the tokens of a user also revokes them.
+
+Run it once after deploying the index, it is idempotent. Tokens issued in the meantime are
+already indexed. Needs the Redis server of the settings.
+
+    python scripts/backfill_user_tokens_index.py --batch-size 1000
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from fastapi_demo.core.auth.redis import redis_users_client
+from fastapi_demo.core.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Index a token with its expiry, the index living as long as its newest token.
+# KEYS[1]: user tokens index, ARGV[1]: token, ARGV[2]: token TTL (-1 without expiry), ARGV[3]: now
+ADD_TO_INDEX_SCRIPT = """
+local ttl = tonumber(ARGV[2])
+local created = redis.call('EXISTS', KEYS[1]) == 0
+if ttl < 0 then
+    redis.call('ZADD', KEYS[1], 'NX', '+inf', ARGV[1])
+    redis.call('PERSIST', KEYS[1])
+    return
+end
+redis.call('ZADD', KEYS[1], 'NX', tonumber(ARGV[3]) + ttl, ARGV[1])
+local index_ttl = redis.call('TTL', KEYS[1])
+if created or (index_ttl >= 0 and index_ttl < ttl) then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+"""
+
+
+async def main(batch_size: int) -> None:
+    key_prefix = settings.REDIS_USERS_TOKEN_KEY_PREFIX
+    index_key_prefix = settings.REDIS_USERS_TOKEN_INDEX_KEY_PREFIX
+    add_to_index = redis_users_client.register_script(ADD_TO_INDEX_SCRIPT)
+    tokens = 0
+    cursor = 0
+    while True:
+        cursor, keys = await redis_users_client.scan(
+            cursor, match=f"{key_prefix}*", count=batch_size
+        )
+        if keys:
+            async with redis_users_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.get(key)
+                    pipe.ttl(key)
+                values = await pipe.execute()
+            now = time.time()
+            async with redis_users_client.pipeline(transaction=False) as pipe:
+                for key, user_id, ttl in zip(keys, values[::2], values[1::2], strict=True):
+                    # gone since the scan (-2)
+                    if user_id is None or ttl == -2:  # noqa: PLR2004
+                        continue
+                    token = key.removeprefix(key_prefix)
+                    await add_to_index(
+                        keys=[f"{index_key_prefix}{user_id}"], args=[token, ttl, now], client=pipe
+                    )
+                    tokens += 1
+                await pipe.execute()
+        if cursor == 0:
+            break
+    logger.info(f"Indexed {tokens} tokens")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,106 @@
+"""
+Compare the cost of authenticating a bearer token with the Redis and the JWT backends.
+
+Needs the Redis server of the settings. The user is served from the users cache so that only
+the token verification is measured.
+
+    python scripts/benchmark_auth_backends.py --requests 10000
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+
+from ulid import ULID
+
+from fastapi_demo.core.auth.backends import (
+    CachedRedisStrategy,
+    SignedTokenStrategy,
+    get_jwt_strategy,
+    invalidation_bus,
+    redis_users_client,
+    token_revocation_list,
+    user_snapshot_cache,
+)
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.models.users import User
+from fastapi_demo.core.utils.cache import LocalTTLCache
+from fastapi_demo.core.utils.redis import redis_pools
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StaticUserManager:
+    # the user is always in the users cache, only its id is parsed
+    @staticmethod
+    def parse_id(value: str) -> ULID:
+        return ULID.from_str(value)
+
+
+async def measure(read: Callable[[], Awaitable[object]], requests: int) -> list[float]:
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await read()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(name: str, durations: list[float]) -> None:
+    micros = sorted(duration * 1_000_000 for duration in durations)
+    logger.info(
+        f"{name:<28} mean={statistics.fmean(micros):8.1f}us "
+        f"p50={micros[len(micros) // 2]:8.1f}us p99={micros[int(len(micros) * 0.99)]:8.1f}us"
+    )
+
+
+async def main(requests: int) -> None:
+    user = User(id=ULID(), email="benchmark@example.com", hashed_password="", is_verified=True)
+    user_snapshot_cache.set(user)
+    user_manager = StaticUserManager()
+
+    strategies = {
+        # every request reads the token from Redis
+        "redis": CachedRedisStrategy(
+            redis_users_client,
+            lifetime_seconds=60,
+            key_prefix=settings.REDIS_USERS_TOKEN_KEY_PREFIX,
+            index_key_prefix=settings.REDIS_USERS_TOKEN_INDEX_KEY_PREFIX,
+            token_cache=LocalTTLCache(maxsize=0, ttl_seconds=0),
+            user_cache=user_snapshot_cache,
+            invalidation_bus=invalidation_bus,
+        ),
+        "redis (local token cache)": CachedRedisStrategy(
+            redis_users_client,
+            lifetime_seconds=60,
+            key_prefix=settings.REDIS_USERS_TOKEN_KEY_PREFIX,
+            index_key_prefix=settings.REDIS_USERS_TOKEN_INDEX_KEY_PREFIX,
+            token_cache=LocalTTLCache(maxsize=1, ttl_seconds=60),
+            user_cache=user_snapshot_cache,
+            invalidation_bus=invalidation_bus,
+        ),
+        "jwt": get_jwt_strategy(),
+    }
+
+    async with redis_pools.managed(), token_revocation_list.running():
+        for name, strategy in strategies.items():
+            token = await strategy.write_token(user)
+            assert await strategy.read_token(token, user_manager)  # type: ignore[arg-type]  # noqa: S101
+            durations = await measure(
+                lambda strategy=strategy, token=token: strategy.read_token(token, user_manager),  # type: ignore[arg-type]
+                requests,
+            )
+            report(name, durations)
+            if not isinstance(strategy, SignedTokenStrategy):
+                await strategy.destroy_token(token, user)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
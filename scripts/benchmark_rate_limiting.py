@@ -0,0 +1,89 @@
+"""
+Compare the rate limiting of a request (burst and sustained rules, with the headers stats)
+through the `limits` library and through the single-script `RateLimitEngine`.
+
+Needs the Redis server of the settings; the benchmark keys are deleted afterwards.
+
+    python scripts/benchmark_rate_limiting.py --requests 5000
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+
+from limits import RateLimitItemPerMinute, RateLimitItemPerSecond
+from limits.aio.storage import RedisStorage
+from limits.aio.strategies import STRATEGIES
+
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.utils.ratelimit import RateLimitEngine
+from fastapi_demo.core.utils.redis import redis_pools
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "BENCHMARK"
+
+
+async def measure(hit: Callable[[str], Awaitable[object]], requests: int) -> list[float]:
+    durations = []
+    for i in range(requests):
+        # a few identifiers so that most of the hits are allowed
+        identifier = f"benchmark:{i % 100}"
+        start = time.perf_counter()
+        await hit(identifier)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(name: str, durations: list[float]) -> None:
+    micros = sorted(duration * 1_000_000 for duration in durations)
+    logger.info(
+        f"{name:<40} mean={statistics.fmean(micros):8.1f}us "
+        f"p50={micros[len(micros) // 2]:8.1f}us p99={micros[int(len(micros) * 0.99)]:8.1f}us"
+    )
+
+
+async def main(requests: int) -> None:
+    burst_rule = RateLimitItemPerSecond(1000)
+    sustained_rule = RateLimitItemPerMinute(10_000)
+    pool = redis_pools.pool(
+        "rate_limiting", db=settings.RATE_LIMITING_REDIS_DB, decode_responses=False
+    )
+    redis = redis_pools.client(
+        "rate_limiting", db=settings.RATE_LIMITING_REDIS_DB, decode_responses=False
+    )
+
+    async with redis_pools.managed():
+        for strategy_name, strategy in STRATEGIES.items():
+            storage = RedisStorage(
+                settings.rate_limiter_storage_uri,
+                implementation="redispy",
+                key_prefix=KEY_PREFIX,
+                connection_pool=pool,  # type: ignore[arg-type]
+            )
+            limiter = strategy(storage)  # type: ignore[abstract]
+            engine = RateLimitEngine(redis, strategy=strategy_name, key_prefix=KEY_PREFIX)  # type: ignore[arg-type]
+
+            async def limits_hit(identifier: str, limiter=limiter) -> None:  # type: ignore[no-untyped-def]
+                await limiter.hit(burst_rule, identifier)
+                await limiter.hit(sustained_rule, identifier)
+                await limiter.get_window_stats(sustained_rule, identifier)
+
+            async def engine_hit(identifier: str, engine=engine) -> None:  # type: ignore[no-untyped-def]
+                await engine.hit([burst_rule, sustained_rule], identifier)
+
+            report(f"{strategy_name} (limits)", await measure(limits_hit, requests))
+            await storage.reset()
+            report(f"{strategy_name} (engine)", await measure(engine_hit, requests))
+            await storage.reset()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,136 @@
+"""
+Compare paginating the users with the ULIDs decoded by `PGULID` from their text format (the
+previous behaviour) and by the asyncpg codec from their binary format.
+
+Needs the Postgres server of the settings. `--users` users are created for the benchmark and
+deleted afterwards. The decoding of the ULIDs alone is also measured, without the database.
+
+    python scripts/benchmark_ulid_decoding.py --users 10000 --page-size 100
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.sql.sqltypes import NullType
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ulid import ULID
+
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.db.types import PGULID, register_ulid_codec
+from fastapi_demo.core.models.users import User
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMAIL_DOMAIN = "benchmark-ulid.example.com"
+
+
+def report(name: str, durations: list[float], rows: int) -> None:
+    millis = sorted(duration * 1000 for duration in durations)
+    logger.info(
+        f"{name:<28} mean={statistics.fmean(millis):8.2f}ms p50={millis[len(millis) // 2]:8.2f}ms "
+        f"rows/s={rows / statistics.fmean(durations):12.0f}"
+    )
+
+
+def benchmark_decoding(values: int, runs: int) -> None:
+    ulids = [ULID() for _ in range(values)]
+    texts = [str(ulid) for ulid in ulids]
+    binaries = [ulid.bytes for ulid in ulids]
+    process = PGULID().result_processor(NullType(), None)
+    for name, decode, encoded in (
+        ("decode text (PGULID)", process, texts),
+        ("decode binary (codec)", ULID.from_bytes, binaries),
+    ):
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            for value in encoded:
+                decode(value)
+            durations.append(time.perf_counter() - start)
+        report(name, durations, values)
+
+
+async def create_users(engine: AsyncEngine, users: int) -> None:
+    async with engine.begin() as connection:
+        await connection.execute(
+            insert(User),
+            [
+                {
+                    "id": ULID(),
+                    "email": f"user-{i}@{EMAIL_DOMAIN}",
+                    "hashed_password": "",
+                    "first_name": "Benchmark",
+                    "last_name": f"User {i}",
+                }
+                for i in range(users)
+            ],
+        )
+
+
+async def delete_users(engine: AsyncEngine) -> None:
+    async with engine.begin() as connection:
+        await connection.execute(delete(User).where(col(User.email).endswith(f"@{EMAIL_DOMAIN}")))
+
+
+async def paginate(engine: AsyncEngine, page_size: int) -> int:
+    # keyset pagination over the ids, as the users listing
+    rows = 0
+    last_id: ULID | None = None
+    async with AsyncSession(engine) as session:
+        while True:
+            statement = (
+                select(User)
+                .where(col(User.email).endswith(f"@{EMAIL_DOMAIN}"))
+                .order_by(col(User.id))
+                .limit(page_size)
+            )
+            if last_id is not None:
+                statement = statement.where(col(User.id) > last_id)
+            users = (await session.exec(statement)).all()
+            if not users:
+                return rows
+            assert isinstance(users[-1].id, ULID)  # noqa: S101
+            rows += len(users)
+            last_id = users[-1].id
+            session.expunge_all()
+
+
+async def main(users: int, page_size: int, runs: int) -> None:
+    benchmark_decoding(users, runs)
+
+    text_engine = create_async_engine(str(settings.POSTGRES_URI))
+    binary_engine = create_async_engine(str(settings.POSTGRES_URI))
+    register_ulid_codec(binary_engine)
+    await create_users(binary_engine, users)
+    try:
+        for name, engine in (
+            ("paginate (text, PGULID)", text_engine),
+            ("paginate (binary codec)", binary_engine),
+        ):
+            rows = await paginate(engine, page_size)  # warm up the pool and statement caches
+            durations = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                await paginate(engine, page_size)
+                durations.append(time.perf_counter() - start)
+            report(name, durations, rows)
+    finally:
+        await delete_users(binary_engine)
+        await text_engine.dispose()
+        await binary_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.page_size, args.runs))
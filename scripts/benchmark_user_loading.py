@@ -0,0 +1,156 @@
+"""
+Compare the queries run to load a user, check that a user exists and verify an API key,
+with the relationships loaded eagerly (the previous defaults) and without them.
+
+Needs the Postgres server of the settings. A user with `--keys` API keys is created for the
+benchmark and deleted afterwards. Bytes are the size of the values of the loaded rows.
+
+    python scripts/benchmark_user_loading.py --keys 1000 --requests 200
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ulid import ULID
+
+from fastapi_demo.core.db.engine import AsyncSessionMaker, engine, replica_set
+from fastapi_demo.core.models.users import APIKey, OAuthAccount, User
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# the previous `lazy="selectin"` and `lazy="joined"` relationships, with their back references
+EAGER_USER_OPTIONS = (
+    selectinload(User.api_keys).selectinload(APIKey.user),  # type: ignore[arg-type]
+    joinedload(User.oauth_accounts).joinedload(OAuthAccount.user),  # type: ignore[arg-type]
+)
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.bytes = 0
+
+    def before_cursor_execute(self, *args: Any) -> None:  # noqa: ARG002
+        self.queries += 1
+
+    def count_rows(self, session: AsyncSession) -> None:
+        # the values of every row loaded in the session
+        for instance in session.sync_session.identity_map.values():
+            self.bytes += sum(len(str(value).encode()) for value in instance.model_dump().values())
+
+
+async def measure(
+    load: Callable[[AsyncSession], Awaitable[object]], requests: int
+) -> tuple[list[float], QueryCounter]:
+    counter = QueryCounter()
+    durations = []
+    # the reads may be routed to the replicas
+    engines = [
+        engine.sync_engine,
+        *(replica.engine.sync_engine for replica in replica_set.replicas),
+    ]
+    for sync_engine in engines:
+        event.listen(sync_engine, "before_cursor_execute", counter.before_cursor_execute)
+    try:
+        for _ in range(requests):
+            async with AsyncSessionMaker() as session:
+                start = time.perf_counter()
+                result = await load(session)
+                durations.append(time.perf_counter() - start)
+                counter.count_rows(session)
+                if result is not None and not isinstance(result, SQLModel):
+                    # columns, not in the session
+                    values = result if isinstance(result, tuple) else (result,)
+                    counter.bytes += sum(len(str(value).encode()) for value in values)
+    finally:
+        for sync_engine in engines:
+            event.remove(sync_engine, "before_cursor_execute", counter.before_cursor_execute)
+    return durations, counter
+
+
+def report(name: str, durations: list[float], counter: QueryCounter, requests: int) -> None:
+    micros = sorted(duration * 1_000_000 for duration in durations)
+    logger.info(
+        f"{name:<36} queries={counter.queries / requests:4.1f} "
+        f"bytes={counter.bytes // requests:9d} "
+        f"mean={statistics.fmean(micros):9.1f}us p99={micros[int(len(micros) * 0.99)]:9.1f}us"
+    )
+
+
+async def create_user(keys: int) -> ULID:
+    user_id = ULID()
+    async with AsyncSessionMaker() as session:
+        session.add(User(id=user_id, email=f"benchmark-{user_id}@example.com", hashed_password=""))
+        await session.flush()
+        session.add_all(
+            APIKey(
+                key_id=f"benchmark-{user_id}-{i}",
+                key_hash="x" * 97,
+                key_preview="fastapi-demo-...xxxx",
+                name=f"benchmark key {i}",
+                owner_id=user_id,
+            )
+            for i in range(keys)
+        )
+        await session.commit()
+    return user_id
+
+
+async def delete_user(user_id: ULID) -> None:
+    async with AsyncSessionMaker() as session:
+        user = await session.get(User, user_id)
+        await session.delete(user)
+        await session.commit()
+
+
+async def main(keys: int, requests: int) -> None:
+    user_id = await create_user(keys)
+    key_id = f"benchmark-{user_id}-0"
+    scenarios: dict[str, Callable[[AsyncSession], Awaitable[object]]] = {
+        # `session.get(User, ...)` was also the existence check of the API keys service
+        "user by id (eager)": lambda session: session.get(
+            User, user_id, options=EAGER_USER_OPTIONS
+        ),
+        "user by id": lambda session: session.get(User, user_id),
+        "user exists (id only)": lambda session: session.exec(
+            select(User.id).where(User.id == user_id)
+        ),
+        "API key verification (eager)": lambda session: session.exec(
+            select(APIKey)
+            .where(APIKey.key_id == key_id)
+            .options(selectinload(APIKey.user).options(*EAGER_USER_OPTIONS))  # type: ignore[arg-type]
+        ),
+        "API key verification (columns)": lambda session: session.exec(
+            select(APIKey.id, APIKey.owner_id, APIKey.key_hash).where(APIKey.key_id == key_id)
+        ),
+    }
+    try:
+        for name, load in scenarios.items():
+
+            async def run(session: AsyncSession, load=load) -> object:  # type: ignore[no-untyped-def]
+                result = await load(session)
+                return result.first() if hasattr(result, "first") else result
+
+            durations, counter = await measure(run, requests)
+            report(name, durations, counter, requests)
+    finally:
+        await delete_user(user_id)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.keys, args.requests))
@@ -0,0 +1,31 @@
+"""Delete the API keys of a user with it
+
+Revision ID: 3c1d7e52a9b4
+Revises: 8f8bc618f975
+Create Date: 2026-10-18 10:12:41.518204
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3c1d7e52a9b4"
+down_revision: str | None = "8f8bc618f975"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_constraint("apikey_owner_id_fkey", "apikey", type_="foreignkey")
+    op.create_foreign_key(
+        "apikey_owner_id_fkey", "apikey", "user", ["owner_id"], ["id"], ondelete="CASCADE"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("apikey_owner_id_fkey", "apikey", type_="foreignkey")
+    op.create_foreign_key("apikey_owner_id_fkey", "apikey", "user", ["owner_id"], ["id"])
@@ -1,26 +1,18 @@
-import time
-from collections.abc import AsyncGenerator
 from functools import lru_cache
 from typing import Annotated, cast
 
-from fastapi import Depends, Header, HTTPException, Request, Response, status
+from fastapi import Depends, Header, HTTPException, Request, status
 from httpx import AsyncClient
 from openfga_sdk import OpenFgaClient
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from fastapi_demo.api.ratelimit import (
-    get_client_ip,
-    get_rate_limit_rules,
-    limiter,
-)
-from fastapi_demo.core.auth.backends import redis_users_client
+from fastapi_demo.core.auth.backends import get_jwt_strategy, invalidation_bus, redis_users_client
 from fastapi_demo.core.auth.users import (
     current_superuser,
     current_verified_active_user,
-    get_current_user,
 )
 from fastapi_demo.core.config import Settings
-from fastapi_demo.core.db.engine import AsyncSessionMaker
+from fastapi_demo.core.db.dependencies import get_request_session
 from fastapi_demo.core.models.users import User
 from fastapi_demo.core.services.api_key import APIKeyService
 from fastapi_demo.core.services.token import TokenService
@@ -40,12 +32,7 @@ SettingsDep = Annotated[Settings, Depends(get_settings)]
 # --- Session Dependency ---
 
 
-async def get_async_session() -> AsyncGenerator[AsyncSession]:
-    async with AsyncSessionMaker() as session:
-        yield session
-
-
-SessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+SessionDep = Annotated[AsyncSession, Depends(get_request_session)]
 
 # --- Async HTTP Client ---
 
@@ -89,48 +76,6 @@ CurrentSuperUserDep = Annotated[User, Depends(current_superuser)]
 # OptionalCurrentSuperUserDep = Annotated[User | None, Depends(optional_current_superuser)]
 
 
-# --- Rate Limit Dependency ---
-
-
-async def rate_limit_dep(
-    request: Request,
-    response: Response,
-    user: Annotated[User | None, Depends(get_current_user)],
-    settings: SettingsDep,
-) -> None:
-    client_ip = get_client_ip(request)
-
-    ip_key = f"ip:{client_ip}"
-    # user_key = f"user:{user_id}" if user_id else None
-    user_key = f"user:{user.id}" if user else None
-
-    identifier = user_key or ip_key
-    burst_rule, sustained_rule = get_rate_limit_rules(request, user_key)
-
-    rate_limited_path = request.url.path != "/healthz/"
-    headers = {}
-
-    if rate_limited_path:
-        allowed_burst = await limiter.hit(burst_rule, identifier)
-        allowed_sustained = await limiter.hit(sustained_rule, identifier)
-
-        if settings.RATE_LIMITING_HEADERS_ENABLED:
-            reset_ts, remaining = await limiter.get_window_stats(sustained_rule, identifier)
-            headers = {
-                "X-RateLimit-Limit": str(sustained_rule.amount),
-                "X-RateLimit-Remaining": str(remaining),
-                "X-RateLimit-Reset": str(int(reset_ts - time.time())),
-            }
-            response.headers.update(headers)
-
-        if not (allowed_burst and allowed_sustained):
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail={"error": f"Rate limit exceeded: {burst_rule} and {sustained_rule}."},
-                headers=headers,
-            )
-
-
 # --- User Service Dependency ---
 
 
@@ -145,7 +90,13 @@ UserServiceDep = Annotated[UserService, Depends(get_user_service)]
 
 
 def get_token_service(settings: SettingsDep) -> TokenService:
-    return TokenService(redis_users_client, settings.REDIS_USERS_TOKEN_KEY_PREFIX)
+    return TokenService(
+        redis_users_client,
+        settings.REDIS_USERS_TOKEN_KEY_PREFIX,
+        settings.REDIS_USERS_TOKEN_INDEX_KEY_PREFIX,
+        invalidation_bus,
+        get_jwt_strategy() if settings.BEARER_AUTH_BACKEND == "jwt" else None,
+    )
 
 
 TokenServiceDep = Annotated[TokenService, Depends(get_token_service)]
@@ -155,7 +106,7 @@ TokenServiceDep = Annotated[TokenService, Depends(get_token_service)]
 
 
 def get_api_key_service(session: SessionDep, settings: SettingsDep) -> APIKeyService:
-    return APIKeyService(session, settings)
+    return APIKeyService(session, settings, redis_users_client, invalidation_bus)
 
 
 APIKeyServiceDep = Annotated[APIKeyService, Depends(get_api_key_service)]
@@ -1,3 +1,4 @@
+import contextlib
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from typing import Any
@@ -9,12 +10,22 @@ from pydantic import BaseModel, ConfigDict
 from sqlakeyset import custom_bookmark_type
 from ulid import ULID
 
+from fastapi_demo.api.ratelimit import leased_rate_limiter
+from fastapi_demo.core.auth.backends import (
+    api_key_shield,
+    api_key_usage_recorder,
+    invalidation_bus,
+    token_revocation_list,
+)
+from fastapi_demo.core.auth.hashing import hashing_executor
 from fastapi_demo.core.config import settings
+from fastapi_demo.core.db.engine import replica_set
 from fastapi_demo.core.utils.openfga import (
     create_openfga_client,
     get_authorization_model_id,
     get_store_id,
 )
+from fastapi_demo.core.utils.redis import redis_pools
 
 
 def _ulid_serialize(value: ULID) -> str:
@@ -54,6 +65,7 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[dict[str, Any]]:  # noqa: ARG
     print(f"{store_id=}")
     print(f"{authorization_model_id=}")
     async with (
+        redis_pools.managed(),
         AsyncClient() as http_client,
         create_openfga_client(
             api_url=str(settings.FGA_API_URL),
@@ -61,6 +73,15 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[dict[str, Any]]:  # noqa: ARG
             store_id=store_id,
             authorization_model_id=authorization_model_id,
         ) as fga_client,
+        invalidation_bus.listening(),
+        api_key_usage_recorder.running(),
+        api_key_shield.running(),
+        # only the signed tokens are checked against the revocation list
+        token_revocation_list.running()
+        if settings.BEARER_AUTH_BACKEND == "jwt"
+        else contextlib.nullcontext(),
+        leased_rate_limiter.running(),
+        replica_set.running(),
     ):
         yield {
             "http_client": http_client,
@@ -68,3 +89,5 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[dict[str, Any]]:  # noqa: ARG
             "authorization_model_id": authorization_model_id,
             "fga_client": fga_client,
         }
+
+    hashing_executor.shutdown()
@@ -1,71 +1,430 @@
-# import time
-#
-# from fastapi import Depends, FastAPI, Request, Response, status
-#
-# from fastapi_demo.api.ratelimit import (
-#     get_client_ip,
-#     get_rate_limit_rules,
-#     limiter,
-# )
-# from fastapi_demo.core.auth.users import get_current_user
-#
-#
-# def add_middlewares(
-#     app: FastAPI,
-#     default_response_class: type[Response],
-#     enable_rate_limit: bool = True,
-#     enable_rate_limit_headers: bool = False,
-# ) -> None:
-#     if not enable_rate_limit:
-#         return
-#
-#     @app.middleware("html")
-#     async def rate_limit_middleware(
-#         request: Request, call_next, user=Depends(get_current_user)
-#     ) -> Response:  # type: ignore[no-untyped-def]
-#         client_ip = get_client_ip(request)
-#
-#         # auth_header = request.headers.get("authorization", "") or request.headers.get(
-#         #     "x-api-key", ""
-#         # )
-#         #
-#         # token = None
-#         # api_key = None
-#         # if auth_header.lower().startswith("bearer "):
-#         #     token = auth_header.split()[1]
-#         # elif auth_header.startswith("fastapi-demo"):
-#         #     api_key = auth_header
-#         # user_id = await get_user_id(token=token, api_key=api_key)
-#
-#         ip_key = f"ip:{client_ip}"
-#         # user_key = f"user:{user_id}" if user_id else None
-#         user_key = f"user:{user.id}" if user else None
-#
-#         burst_rule, sustained_rule = get_rate_limit_rules(request, user_key)
-#         identifier = user_key or ip_key
-#
-#         rate_limited_path = "/healthz" not in request.url.path
-#         headers = {}
-#
-#         if rate_limited_path:
-#             allowed_burst = await limiter.hit(burst_rule, identifier)
-#             allowed_sustained = await limiter.hit(sustained_rule, identifier)
-#
-#             if enable_rate_limit_headers:
-#                 reset_ts, remaining = await limiter.get_window_stats(sustained_rule, identifier)
-#                 headers = {
-#                     "X-RateLimit-Limit": str(sustained_rule.amount),
-#                     "X-RateLimit-Remaining": str(remaining),
-#                     "X-RateLimit-Reset": str(int(reset_ts - time.time())),
-#                 }
-#
-#             if not (allowed_burst and allowed_sustained):
-#                 return default_response_class(
-#                     status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-#                     content={"error": f"Rate limit exceeded: {burst_rule} and {sustained_rule}."},
-#                     headers=headers,
-#                 )
-#
-#         response = await call_next(request)
-#         response.headers.update(headers)
-#         return response  # type: ignore[no-any-return]
+import asyncio
+import logging
+import time
+from collections.abc import Collection
+
+from fastapi import FastAPI, status
+from sqlalchemy.exc import DBAPIError
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from ulid import ULID
+
+from fastapi_demo.api.ratelimit import (
+    RateLimitRuleTable,
+    concurrency_limiter,
+    get_rate_limit_key,
+    get_rate_limit_rules,
+    get_scope_policy,
+    limiter,
+    needs_principal,
+)
+from fastapi_demo.core.auth.users import resolve_principal
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.db.engine import AsyncSessionMaker
+from fastapi_demo.core.utils.admission import AdmissionController, admission_controller
+from fastapi_demo.core.utils.concurrency import LocalConcurrencyLimiter, RedisConcurrencyLimiter
+from fastapi_demo.core.utils.deadline import (
+    DeadlineExceededError,
+    request_deadline,
+    set_deadline,
+)
+from fastapi_demo.core.utils.ratelimit import ResilientRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class AuthenticationMiddleware:
+    """
+    Resolve the principal of the HTTP requests the limiters key on the client, once, before
+    the routing, and keep it in the request state where `get_current_user` and the rate
+    limiter read it.
+    - Requests to routes limited by IP alone (login, registration...) are limited before any
+      authentication work: `get_current_user` resolves their principal, if the route needs it.
+    - Errors are stored with the principal and raised by the dependencies, so they still go
+      through the exception handlers.
+    - The session it opens is kept in the request state for the route, see
+      `get_request_session`.
+    """
+
+    def __init__(self, app: ASGIApp, *, limits_enabled: bool = True):
+        self.app = app
+        self.limits_enabled = limits_enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            compile_rule_table(scope)
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        async with AsyncSessionMaker() as session:
+            request.state.session = session
+            policy = get_scope_policy(scope)
+            if self.limits_enabled and needs_principal(policy):
+                request.state.principal = await resolve_principal(request)
+                # the connection goes back to the pool while the request waits for the
+                # limiters and the principal is detached, whatever the route does with the
+                # session
+                await session.close()
+            await self.app(scope, receive, send)
+
+
+def compile_rule_table(scope: Scope) -> None:
+    # all the routes are included once the app starts
+    scope["app"].state.rate_limit_rule_table = RateLimitRuleTable(scope["app"].routes)
+
+
+def get_user_id(request: Request) -> ULID | None:
+    principal = getattr(request.state, "principal", None)
+    return principal.user.id if principal and principal.user else None
+
+
+class RateLimitMiddleware:
+    """
+    Rate limit the HTTP requests from their scope alone, before the routing, the dependencies
+    and the body parsing: rejected requests never reach FastAPI.
+    - The client is the authenticated user set by `AuthenticationMiddleware`, or its IP; the
+      principal isn't resolved for the routes limited by IP alone.
+    - The limits, cost and key of every route come from its `RateLimitPolicy`, compiled
+      into a `RateLimitRuleTable` when the app starts.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        limiter: ResilientRateLimiter,
+        response_class: type[Response],
+        headers_enabled: bool = False,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.response_class = response_class
+        self.headers_enabled = headers_enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            compile_rule_table(scope)
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = get_scope_policy(scope)
+        if policy.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        user_id = get_user_id(request)
+        identifier = get_rate_limit_key(policy, request, user_id)
+        burst_rule, sustained_rule = get_rate_limit_rules(policy, authenticated=user_id is not None)
+        burst, sustained = await self.limiter.hit(
+            [burst_rule, sustained_rule],
+            identifier,
+            cost=policy.cost,
+            on_failure=policy.on_failure or settings.RATE_LIMITING_ON_FAILURE,
+        )
+
+        headers = {}
+        if self.headers_enabled:
+            headers = {
+                "X-RateLimit-Limit": str(sustained_rule.amount),
+                "X-RateLimit-Remaining": str(sustained.remaining),
+                "X-RateLimit-Reset": str(int(sustained.reset_time - time.time())),
+            }
+
+        if not (burst.allowed and sustained.allowed):
+            response = self.response_class(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={
+                    "detail": {"error": f"Rate limit exceeded: {burst_rule} and {sustained_rule}."}
+                },
+                headers=headers,
+            )
+            await response(scope, receive, send)
+            return
+
+        if headers:
+
+            async def send_with_headers(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message).update(headers)
+                await send(message)
+
+            await self.app(scope, receive, send_with_headers)
+            return
+        await self.app(scope, receive, send)
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Cap the requests in flight at once per client, so that a single client can't hold most
+    of the DB connections with slow requests.
+    - The client is the same as for the rate limits, the routes exempted from the rate
+      limits are also exempted from the concurrency limit.
+    - Requests over the limit wait for up to `max_wait_seconds` and are rejected after.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        limiter: LocalConcurrencyLimiter | RedisConcurrencyLimiter,
+        response_class: type[Response],
+        max_wait_seconds: float,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.response_class = response_class
+        self.max_wait_seconds = max_wait_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            compile_rule_table(scope)
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = get_scope_policy(scope)
+        if policy.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        user_id = get_user_id(request)
+        key = get_rate_limit_key(policy, request, user_id)
+        limit = (
+            settings.CONCURRENCY_LIMIT_LOGGEDIN
+            if user_id is not None
+            else settings.CONCURRENCY_LIMIT_PUBLIC
+        )
+        token = await self.limiter.acquire(key, limit=limit, timeout=self.max_wait_seconds)
+        if token is None:
+            response = self.response_class(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": {"error": f"Too many concurrent requests: {limit} at most."}},
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.limiter.release(key, token)
+
+
+class AdmissionControlMiddleware:
+    """
+    Shed the HTTP requests over the adaptive concurrency limit of the process with a fast
+    503, before any authentication or rate limiting work.
+    - The priority of every route comes from its `RateLimitPolicy`.
+    - The latency and the 5xx responses of the admitted requests adapt the limit, against
+      the latency target of their `RateLimitPolicy`. Requests cancelled before any response
+      don't count.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        controller: AdmissionController,
+        response_class: type[Response],
+        retry_after_seconds: int,
+    ):
+        self.app = app
+        self.controller = controller
+        self.response_class = response_class
+        self.retry_after_seconds = retry_after_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            compile_rule_table(scope)
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = get_scope_policy(scope)
+        if policy.priority == "critical":
+            await self.app(scope, receive, send)
+            return
+        if not self.controller.try_acquire(policy.priority):
+            response = self.response_class(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"detail": {"error": "The server is overloaded, retry later."}},
+                headers={"Retry-After": str(self.retry_after_seconds)},
+            )
+            await response(scope, receive, send)
+            return
+
+        status_code: int | None = None
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status_code = status_code or status.HTTP_500_INTERNAL_SERVER_ERROR
+            raise
+        finally:
+            # requests without a response were cancelled (client disconnect, shutdown)
+            self.controller.release(
+                time.perf_counter() - start if status_code is not None else None,
+                failed=(status_code or 0) >= status.HTTP_500_INTERNAL_SERVER_ERROR,
+                latency_target_seconds=policy.latency_target_seconds,
+            )
+
+
+class DeadlineMiddleware:
+    """
+    Give every HTTP request `timeout_seconds` to complete, through the `request_deadline`
+    context variable read by the Postgres, Redis and OpenFGA clients.
+    - A request whose deadline is over, or whose query was cancelled by the statement
+      timeout, gets a 504 unless its response has started.
+    """
+
+    def __init__(
+        self, app: ASGIApp, *, timeout_seconds: float | None, response_class: type[Response]
+    ):
+        self.app = app
+        self.timeout_seconds = timeout_seconds
+        self.response_class = response_class
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.timeout_seconds is None:
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_with_state(message: Message) -> None:
+            nonlocal response_started
+            response_started |= message["type"] == "http.response.start"
+            await send(message)
+
+        token = set_deadline(self.timeout_seconds)
+        try:
+            await self.app(scope, receive, send_with_state)
+        except (DeadlineExceededError, DBAPIError) as exc:
+            query_cancelled = getattr(getattr(exc, "orig", None), "sqlstate", None) == "57014"
+            if response_started or not (isinstance(exc, DeadlineExceededError) or query_cancelled):
+                raise
+            response = self.response_class(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                content={"message": str(DeadlineExceededError())},
+            )
+            await response(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+
+
+class DisconnectMiddleware:
+    """
+    Cancel the handling of a request as soon as its client disconnects, so that its queries
+    don't keep DB connections busy for a response nobody will read.
+    - The request is handled in a task, cancelled on `http.disconnect`; asyncpg then sends a
+      cancel request for the running query and the session rolls back and returns its
+      connection to the pool.
+    - Only the `methods` without side effects are cancelled, writes are left to complete.
+    - Once the response is sent, the request is never cancelled.
+    """
+
+    def __init__(self, app: ASGIApp, *, methods: Collection[str] = ("GET", "HEAD", "OPTIONS")):
+        self.app = app
+        self.methods = frozenset(methods)
+        self.cancelled = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in self.methods:
+            await self.app(scope, receive, send)
+            return
+
+        # the client messages are read here and handed over to the app
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        disconnected = False
+        responded = False
+
+        async def send_response(message: Message) -> None:
+            nonlocal responded
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # the server reports a disconnect once the response is complete: the work left
+                # (releases, background tasks) must not be cancelled
+                responded = True
+                watcher.cancel()
+
+        async def watch_disconnect() -> None:
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect" and not responded:
+                    disconnected = True
+                    app_task.cancel()
+                    return
+
+        async def run_app() -> None:
+            await self.app(scope, messages.get, send_response)
+
+        app_task: asyncio.Task[None] = asyncio.create_task(run_app())
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            app_task.cancel()
+            if not disconnected:
+                raise
+            self.cancelled += 1
+            logger.debug("Cancelled %s %s: the client disconnected", scope["method"], scope["path"])
+        finally:
+            watcher.cancel()
+
+
+def add_middlewares(
+    app: FastAPI,
+    default_response_class: type[Response],
+    enable_rate_limit: bool = True,
+    enable_rate_limit_headers: bool = False,
+    enable_concurrency_limit: bool = False,
+    enable_admission_control: bool = False,
+    enable_disconnect_cancellation: bool = False,
+) -> None:
+    # the last middleware added runs first
+    if enable_concurrency_limit:
+        app.add_middleware(
+            ConcurrencyLimitMiddleware,
+            limiter=concurrency_limiter,
+            response_class=default_response_class,
+            max_wait_seconds=settings.CONCURRENCY_LIMITING_MAX_WAIT_SECONDS,
+        )
+    if enable_rate_limit:
+        app.add_middleware(
+            RateLimitMiddleware,
+            limiter=limiter,
+            response_class=default_response_class,
+            headers_enabled=enable_rate_limit_headers,
+        )
+    app.add_middleware(
+        AuthenticationMiddleware, limits_enabled=enable_rate_limit or enable_concurrency_limit
+    )
+    if enable_disconnect_cancellation:
+        app.add_middleware(DisconnectMiddleware)
+    app.add_middleware(
+        DeadlineMiddleware,
+        timeout_seconds=settings.REQUEST_TIMEOUT_SECONDS,
+        response_class=default_response_class,
+    )
+    if enable_admission_control:
+        app.add_middleware(
+            AdmissionControlMiddleware,
+            controller=admission_controller,
+            response_class=default_response_class,
+            retry_after_seconds=settings.ADMISSION_CONTROL_RETRY_AFTER_SECONDS,
+        )
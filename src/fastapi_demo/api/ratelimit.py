@@ -1,9 +1,30 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+from re import Pattern
+from typing import Literal
+
 from fastapi import Request
-from limits import RateLimitItemPerMinute, RateLimitItemPerSecond
-from limits.aio.storage import RedisStorage
-from limits.aio.strategies import STRATEGIES
+from fastapi.routing import APIRoute
+from limits import RateLimitItem, RateLimitItemPerMinute, RateLimitItemPerSecond
+from starlette._utils import get_route_path
+from starlette.applications import Starlette
+from starlette.routing import BaseRoute, Route
+from starlette.types import Scope
+from ulid import ULID
 
+from fastapi_demo.core.auth.backends import api_key_transport
 from fastapi_demo.core.config import settings
+from fastapi_demo.core.utils.admission import Priority
+from fastapi_demo.core.utils.circuit_breaker import CircuitBreaker
+from fastapi_demo.core.utils.concurrency import LocalConcurrencyLimiter, RedisConcurrencyLimiter
+from fastapi_demo.core.utils.network import get_client_ip
+from fastapi_demo.core.utils.ratelimit import (
+    LeasedRateLimiter,
+    LocalRateLimiter,
+    RateLimitEngine,
+    ResilientRateLimiter,
+)
+from fastapi_demo.core.utils.redis import redis_pools
 
 auth_burst_limit = RateLimitItemPerSecond(settings.RATE_LIMIT_VALUE_PER_SECOND_AUTH)
 loggedin_burst_limit = RateLimitItemPerSecond(settings.RATE_LIMIT_VALUE_PER_SECOND_LOGGEDIN)
@@ -13,21 +34,39 @@ auth_sustained_limit = RateLimitItemPerMinute(settings.RATE_LIMIT_VALUE_PER_MINU
 loggedin_sustained_limit = RateLimitItemPerMinute(settings.RATE_LIMIT_VALUE_PER_MINUTE_LOGGEDIN)
 public_sustained_limit = RateLimitItemPerMinute(settings.RATE_LIMIT_VALUE_PER_MINUTE_PUBLIC)
 
-storage = RedisStorage(settings.rate_limiter_storage_uri, implementation="redispy")
-strategy = STRATEGIES[settings.RATE_LIMITING_STRATEGY]
-limiter = strategy(storage)  # type: ignore[abstract]
-
+rate_limiting_redis_client = redis_pools.client(
+    "rate_limiting", db=settings.RATE_LIMITING_REDIS_DB, decode_responses=False
+)
+rate_limit_engine = RateLimitEngine(
+    rate_limiting_redis_client, strategy=settings.RATE_LIMITING_STRATEGY
+)
+leased_rate_limiter = LeasedRateLimiter(
+    rate_limit_engine,
+    lease_size=settings.RATE_LIMITING_LEASE_SIZE,
+    lease_ttl_seconds=settings.RATE_LIMITING_LEASE_TTL_SECONDS,
+    max_leases=settings.RATE_LIMITING_MAX_LEASES,
+)
+limiter = ResilientRateLimiter(
+    leased_rate_limiter if settings.RATE_LIMITING_MODE == "leased" else rate_limit_engine,
+    fallback=LocalRateLimiter(max_keys=settings.RATE_LIMITING_FALLBACK_MAX_KEYS),
+    breaker=CircuitBreaker(
+        "rate_limiting",
+        failure_threshold=settings.RATE_LIMITING_BREAKER_FAILURE_THRESHOLD,
+        recovery_seconds=settings.RATE_LIMITING_BREAKER_RECOVERY_SECONDS,
+    ),
+    timeout_seconds=settings.RATE_LIMITING_TIMEOUT_SECONDS,
+)
 
-def get_client_ip(request: Request) -> str:
-    # if behind a load-balancer or an API gateway
-    xff = request.headers.get("x-forwarded-for")
-    if xff:
-        ip = xff.split(",")[0].strip()
-    elif request.client:
-        ip = request.client.host
-    else:
-        "127.0.0.1"
-    return ip
+concurrency_limiter = (
+    RedisConcurrencyLimiter(
+        rate_limiting_redis_client,
+        slot_ttl_seconds=settings.CONCURRENCY_LIMITING_SLOT_TTL_SECONDS,
+        poll_interval_seconds=settings.CONCURRENCY_LIMITING_POLL_INTERVAL_SECONDS,
+        call_timeout_seconds=settings.RATE_LIMITING_TIMEOUT_SECONDS,
+    )
+    if settings.CONCURRENCY_LIMITING_MODE == "redis"
+    else LocalConcurrencyLimiter()
+)
 
 
 # @cached(
@@ -46,16 +85,138 @@ def get_client_ip(request: Request) -> str:
 #     return None
 
 
+# --- Rate Limit Policies ---
+
+
+@dataclass(frozen=True, slots=True)
+class RateLimitPolicy:
+    """
+    Rate limit policy of a route, declared as a dependency of the route or of its router:
+    `dependencies=[Depends(auth_rate_limit)]`; the innermost policy applies.
+    - Without limits, the logged in or public limits apply depending on the client.
+    - `cost` is the number of hits taken by a request, to weight the expensive routes
+      (password hashing...) against the budget they share with the others.
+    - `key_type` is what the hits are counted against: the client IP, the authenticated
+      user (the IP of anonymous clients) or the API key (the user of bearer clients).
+    - `on_failure` overrides `RATE_LIMITING_ON_FAILURE` for the route while Redis is out.
+    - `priority` is the class of the route when the process sheds load, see
+      `AdmissionController`; exempted routes still go through the admission control.
+    - `latency_target_seconds` overrides `ADMISSION_CONTROL_LATENCY_TARGET_SECONDS` for the
+      routes slow by design (password hashing, OAuth callbacks, searches), so that they don't
+      shrink the admission limit of every route.
+    - Declared dependencies are only metadata, the limits are applied by the middleware.
+    """
+
+    burst: RateLimitItem | None = None
+    sustained: RateLimitItem | None = None
+    cost: int = 1
+    key_type: Literal["ip", "user", "api_key"] = "user"
+    on_failure: Literal["local", "open", "closed"] | None = None
+    priority: Priority = "normal"
+    latency_target_seconds: float | None = None
+    exempt: bool = False
+
+    async def __call__(self) -> None:
+        return None
+
+
+default_rate_limit = RateLimitPolicy()
+auth_rate_limit = RateLimitPolicy(auth_burst_limit, auth_sustained_limit, priority="high")
+oauth_rate_limit = RateLimitPolicy(
+    auth_burst_limit,
+    auth_sustained_limit,
+    priority="high",
+    latency_target_seconds=settings.ADMISSION_CONTROL_SLOW_LATENCY_TARGET_SECONDS,
+)
+password_hashing_rate_limit = RateLimitPolicy(
+    auth_burst_limit,
+    auth_sustained_limit,
+    cost=settings.RATE_LIMIT_COST_PASSWORD_HASHING,
+    key_type="ip",
+    priority="high",
+    latency_target_seconds=settings.ADMISSION_CONTROL_SLOW_LATENCY_TARGET_SECONDS,
+)
+api_key_creation_rate_limit = RateLimitPolicy(
+    cost=settings.RATE_LIMIT_COST_PASSWORD_HASHING,
+    latency_target_seconds=settings.ADMISSION_CONTROL_SLOW_LATENCY_TARGET_SECONDS,
+)
+search_rate_limit = RateLimitPolicy(
+    latency_target_seconds=settings.ADMISSION_CONTROL_SLOW_LATENCY_TARGET_SECONDS
+)
+no_rate_limit = RateLimitPolicy(priority="critical", exempt=True)
+
+
+def get_route_policy(route: BaseRoute) -> RateLimitPolicy:
+    if isinstance(route, APIRoute):
+        for dependency in reversed(route.dependencies):
+            if isinstance(dependency.dependency, RateLimitPolicy):
+                return dependency.dependency
+    return default_rate_limit
+
+
+class RateLimitRuleTable:
+    """
+    Rate limit policy of every route, compiled once from the app routes.
+    - Static paths are looked up in a dict, only the paths with parameters are matched
+      against the routes regexes.
+    - Paths or methods matching no route get the default policy, so that scans are limited.
+    """
+
+    def __init__(self, routes: Sequence[BaseRoute]):
+        self.static_paths: dict[str, list[tuple[set[str] | None, RateLimitPolicy]]] = {}
+        self.dynamic_paths: list[tuple[Pattern[str], set[str] | None, RateLimitPolicy]] = []
+        for route in routes:
+            if not isinstance(route, Route):
+                continue
+            policy = get_route_policy(route)
+            if route.param_convertors:
+                self.dynamic_paths.append((route.path_regex, route.methods, policy))
+            else:
+                self.static_paths.setdefault(route.path, []).append((route.methods, policy))
+
+    def match(self, method: str, path: str) -> RateLimitPolicy:
+        for methods, policy in self.static_paths.get(path, ()):
+            if methods is None or method in methods:
+                return policy
+        for path_regex, methods, policy in self.dynamic_paths:
+            if (methods is None or method in methods) and path_regex.match(path):
+                return policy
+        return default_rate_limit
+
+
+def get_rule_table(app: Starlette) -> RateLimitRuleTable:
+    if getattr(app.state, "rate_limit_rule_table", None) is None:
+        app.state.rate_limit_rule_table = RateLimitRuleTable(app.routes)
+    return app.state.rate_limit_rule_table  # type: ignore[no-any-return]
+
+
+def get_scope_policy(scope: Scope) -> RateLimitPolicy:
+    # the routes match the path without the `root_path` the app is served under
+    return get_rule_table(scope["app"]).match(scope["method"], get_route_path(scope))
+
+
 def get_rate_limit_rules(
-    request: Request, user_key: str | None
-) -> tuple[RateLimitItemPerSecond, RateLimitItemPerMinute]:
-    if "/auth/" in request.url.path:
-        burst_rule = auth_burst_limit
-        sustained_rule = auth_sustained_limit
-    elif user_key:
-        burst_rule = loggedin_burst_limit
-        sustained_rule = loggedin_sustained_limit
+    policy: RateLimitPolicy, authenticated: bool
+) -> tuple[RateLimitItem, RateLimitItem]:
+    if authenticated:
+        default_burst_rule, default_sustained_rule = loggedin_burst_limit, loggedin_sustained_limit
     else:
-        burst_rule = public_burst_limit
-        sustained_rule = public_sustained_limit
-    return (burst_rule, sustained_rule)
+        default_burst_rule, default_sustained_rule = public_burst_limit, public_sustained_limit
+    return (policy.burst or default_burst_rule, policy.sustained or default_sustained_rule)
+
+
+def needs_principal(policy: RateLimitPolicy) -> bool:
+    # the limits of a route keyed by IP, with its own limits, don't depend on the client
+    return not policy.exempt and (
+        policy.key_type != "ip" or policy.burst is None or policy.sustained is None
+    )
+
+
+def get_rate_limit_key(policy: RateLimitPolicy, request: Request, user_id: ULID | None) -> str:
+    if user_id is None or policy.key_type == "ip":
+        return f"ip:{get_client_ip(request)}"
+    if policy.key_type == "api_key" and "authorization" not in request.headers:
+        api_key = request.headers.get(api_key_transport.scheme.model.name)
+        if api_key:
+            return f"api_key:{api_key.split('.', maxsplit=1)[0]}"
+    return f"user:{user_id}"
@@ -1,27 +1,37 @@
 from typing import Annotated
 
 from fastapi import APIRouter, Body, Depends, status
+from fastapi.routing import APIRoute
 from ulid import ULID
 
 from fastapi_demo.api.dependencies import (
     APIKeyServiceDep,
     TokenServiceDep,
 )
-from fastapi_demo.core.auth.backends import redis_auth_backend
+from fastapi_demo.api.ratelimit import auth_rate_limit, password_hashing_rate_limit
+from fastapi_demo.core.auth.backends import bearer_auth_backend
 from fastapi_demo.core.auth.users import (
     current_superuser,
     fastapi_users,
 )
 from fastapi_demo.core.schemas.users import UserCreate, UserRead
 
-router = APIRouter()
-
-router.include_router(fastapi_users.get_auth_router(redis_auth_backend, requires_verification=True))
-# router.include_router(
-#     fastapi_users.get_auth_router(jwt_auth_backend, requires_verification=True), prefix="/jwt"
-# )
-router.include_router(fastapi_users.get_register_router(UserRead, UserCreate))
-router.include_router(fastapi_users.get_reset_password_router())
+router = APIRouter(dependencies=[Depends(auth_rate_limit)])
+
+auth_router = fastapi_users.get_auth_router(bearer_auth_backend, requires_verification=True)
+# only the login hashes a password: the logout keeps the limits of the user
+for route in auth_router.routes:
+    if isinstance(route, APIRoute) and route.name == f"auth:{bearer_auth_backend.name}.login":
+        route.dependencies.append(Depends(password_hashing_rate_limit))
+router.include_router(auth_router)
+router.include_router(
+    fastapi_users.get_register_router(UserRead, UserCreate),
+    dependencies=[Depends(password_hashing_rate_limit)],
+)
+router.include_router(
+    fastapi_users.get_reset_password_router(),
+    dependencies=[Depends(password_hashing_rate_limit)],
+)
 router.include_router(fastapi_users.get_verify_router(UserRead))
 
 
@@ -6,9 +6,12 @@ from ulid import ULID
 from fastapi_demo.api.dependencies import (
     APIKeyServiceDep,
     CurrentVerifiedActiveUserDep,
+    TokenServiceDep,
     UserServiceDep,
 )
+from fastapi_demo.api.ratelimit import api_key_creation_rate_limit, search_rate_limit
 from fastapi_demo.core.auth.users import current_superuser, fastapi_users
+from fastapi_demo.core.config import settings
 from fastapi_demo.core.schemas.api_keys import (
     APIKeyCreateRequest,
     APIKeyCreateResponse,
@@ -17,14 +20,24 @@ from fastapi_demo.core.schemas.api_keys import (
     RevokedAPIKeys,
 )
 from fastapi_demo.core.schemas.base import CursorPage
+from fastapi_demo.core.schemas.tokens import SessionRead
 from fastapi_demo.core.schemas.users import UserRead, UserUpdate
+from fastapi_demo.core.utils.deadline import RequestDeadline
 
 router = fastapi_users.get_users_router(UserRead, UserUpdate)
 
 # --- All Users ---
 
 
-@router.get("/", response_model=CursorPage[UserRead], dependencies=[Depends(current_superuser)])
+@router.get(
+    "/",
+    response_model=CursorPage[UserRead],
+    dependencies=[
+        Depends(current_superuser),
+        Depends(RequestDeadline(settings.REQUEST_TIMEOUT_SECONDS_SEARCH)),
+        Depends(search_rate_limit),
+    ],
+)
 async def read_all_users(
     service: UserServiceDep,
     is_active: Annotated[bool | None, Query()] = None,
@@ -41,10 +54,23 @@ async def read_all_users(
 #     return await service.read_all_users(**query_params.model_dump())
 
 
+# --- Users Sessions ---
+
+
+@router.get("/me/sessions", response_model=list[SessionRead], tags=["sessions"])
+async def read_my_sessions(user: CurrentVerifiedActiveUserDep, service: TokenServiceDep):
+    return await service.list_sessions(user.id)
+
+
 # --- Users API Keys Management ---
 
 
-@router.get("/me/keys/", response_model=CursorPage[APIKeyRead], tags=["api_keys"])
+@router.get(
+    "/me/keys/",
+    response_model=CursorPage[APIKeyRead],
+    dependencies=[Depends(search_rate_limit)],
+    tags=["api_keys"],
+)
 async def read_all_my_api_keys(
     user: CurrentVerifiedActiveUserDep,
     service: APIKeyServiceDep,
@@ -57,7 +83,12 @@ async def read_all_my_api_keys(
     )
 
 
-@router.post("/me/keys/", response_model=APIKeyCreateResponse, tags=["api_keys"])
+@router.post(
+    "/me/keys/",
+    response_model=APIKeyCreateResponse,
+    dependencies=[Depends(api_key_creation_rate_limit)],
+    tags=["api_keys"],
+)
 async def create_personal_key(
     user: CurrentVerifiedActiveUserDep,
     api_key_create: APIKeyCreateRequest,
@@ -102,7 +133,7 @@ async def revoke_all_my_api_keys(service: APIKeyServiceDep, user: CurrentVerifie
 @router.get(
     "/{user_id}/keys/",
     response_model=CursorPage[APIKeyRead],
-    dependencies=[Depends(current_superuser)],
+    dependencies=[Depends(current_superuser), Depends(search_rate_limit)],
     tags=["api_keys"],
 )
 async def read_user_all_api_keys(
@@ -114,7 +145,7 @@ async def read_user_all_api_keys(
 @router.post(
     "/{user_id}/keys/",
     response_model=APIKeyCreateResponse,
-    dependencies=[Depends(current_superuser)],
+    dependencies=[Depends(current_superuser), Depends(api_key_creation_rate_limit)],
     tags=["api_keys"],
 )
 async def create_key_for_user(
@@ -1,3 +1,27 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+
+from fastapi_demo.api.ratelimit import concurrency_limiter, leased_rate_limiter, limiter
+from fastapi_demo.core.auth.hashing import hashing_executor
+from fastapi_demo.core.auth.users import current_superuser
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.db.engine import replica_set
+from fastapi_demo.core.utils.admission import admission_controller
+from fastapi_demo.core.utils.redis import redis_pools
 
 router = APIRouter(prefix="/utils", tags=["utils"])
+
+
+@router.get("/metrics", dependencies=[Depends(current_superuser)])
+async def read_metrics():
+    return {
+        "hashing": hashing_executor.stats(),
+        "redis_pools": redis_pools.stats(),
+        "rate_limiting": {
+            "mode": settings.RATE_LIMITING_MODE,
+            **leased_rate_limiter.stats(),
+            **limiter.stats(),
+        },
+        "concurrency_limiting": concurrency_limiter.stats(),
+        "admission_control": admission_controller.stats(),
+        "read_replicas": replica_set.stats(),
+    }
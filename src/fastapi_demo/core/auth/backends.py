@@ -1,42 +1,175 @@
-from datetime import datetime, timezone
+import hashlib
+import secrets
+import time
+from typing import Any, NamedTuple, cast
 
+import jwt
 import redis.asyncio as aioredis
 from fastapi.security import APIKeyHeader
-from fastapi_users import exceptions
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
-    # JWTStrategy,
+    JWTStrategy,
     RedisStrategy,
     Strategy,
     Transport,
 )
-from pwdlib.hashers.argon2 import Argon2Hasher
+from fastapi_users.jwt import decode_jwt, generate_jwt
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import async_sessionmaker
-from sqlmodel import select
+from sqlmodel import col, select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 from ulid import ULID
 
+from fastapi_demo.core.auth.hashing import api_key_hasher
 from fastapi_demo.core.auth.manager import UserManager
+from fastapi_demo.core.auth.redis import invalidation_bus, redis_users_client
+from fastapi_demo.core.auth.revocation import (
+    REVOKED_TOKEN_NAMESPACE,
+    REVOKED_USER_TOKENS_NAMESPACE,
+    TokenRevocationList,
+)
+from fastapi_demo.core.auth.shield import APIKeyShield
+from fastapi_demo.core.auth.user_cache import USER_CACHE_NAMESPACE, UserSnapshotCache
 from fastapi_demo.core.config import settings
-from fastapi_demo.core.db.engine import AsyncSessionMaker
+from fastapi_demo.core.db.engine import AsyncSessionMaker, replica_set
+from fastapi_demo.core.db.replicas import RecentWrites, reads_from_replica, replica_reads
 from fastapi_demo.core.exceptions import InvalidAPIKeyError
 from fastapi_demo.core.models.users import APIKey, User
+from fastapi_demo.core.services.api_key import API_KEY_CACHE_NAMESPACE, API_KEY_CREATED_NAMESPACE
+from fastapi_demo.core.services.api_key_usage import APIKeyUsageRecorder
+from fastapi_demo.core.services.token import BEARER_TOKEN_CACHE_NAMESPACE
+from fastapi_demo.core.utils.cache import LocalTTLCache
+from fastapi_demo.core.utils.pubsub import InvalidationBus
 
 # --- Redis Backend ---
 
 relative_api_prefix = settings.API_PREFIX.lstrip("/")
 redis_bearer_transport = BearerTransport(tokenUrl=f"{relative_api_prefix}/auth/login")
-redis_users_client = aioredis.from_url(
-    str(settings.REDIS_URI), decode_responses=True, db=settings.REDIS_USERS_DB
+recent_user_writes = RecentWrites(
+    maxsize=settings.POSTGRES_REPLICA_RECENT_WRITES_MAX_SIZE,
+    ttl_seconds=replica_set.staleness_bound_seconds,
+)
+invalidation_bus.register(
+    USER_CACHE_NAMESPACE, recent_user_writes.add, on_reset=recent_user_writes.reset
+)
+user_snapshot_cache = UserSnapshotCache(
+    maxsize=settings.USER_LOCAL_CACHE_MAX_SIZE,
+    ttl_seconds=settings.USER_LOCAL_CACHE_TTL_SECONDS,
+    session_factory=AsyncSessionMaker,
+    recent_writes=recent_user_writes,
 )
+invalidation_bus.register(
+    USER_CACHE_NAMESPACE, user_snapshot_cache.delete, on_reset=user_snapshot_cache.clear
+)
+
+
+class IndexedRedisStrategy(RedisStrategy[User, ULID]):
+    """
+    `RedisStrategy` that also keeps a per-user index of the issued tokens: a sorted set of
+    the tokens scored by their expiry timestamp. A user's sessions can then be listed and
+    revoked without scanning the whole keyspace.
+    """
 
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        lifetime_seconds: int | None = None,
+        *,
+        key_prefix: str,
+        index_key_prefix: str,
+    ):
+        super().__init__(redis, lifetime_seconds, key_prefix=key_prefix)
+        self.index_key_prefix = index_key_prefix
 
-def get_redis_strategy() -> RedisStrategy:
-    return RedisStrategy(
+    async def write_token(self, user: User) -> str:
+        token = secrets.token_urlsafe()
+        now = time.time()
+        index_key = f"{self.index_key_prefix}{user.id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"{self.key_prefix}{token}", str(user.id), ex=self.lifetime_seconds)
+            if self.lifetime_seconds is None:
+                pipe.zadd(index_key, {token: "+inf"})
+            else:
+                pipe.zadd(index_key, {token: now + self.lifetime_seconds})
+                # all tokens share the same lifetime: the index lives as long as the newest one
+                pipe.expire(index_key, self.lifetime_seconds)
+            pipe.zremrangebyscore(index_key, "-inf", now)
+            await pipe.execute()
+        return token
+
+    async def destroy_token(self, token: str, user: User) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(f"{self.key_prefix}{token}")
+            pipe.zrem(f"{self.index_key_prefix}{user.id}", token)
+            await pipe.execute()
+
+
+class CachedRedisStrategy(IndexedRedisStrategy):
+    """
+    `IndexedRedisStrategy` with a per-worker cache of the tokens owners and of the users,
+    so that most requests hit neither Redis nor Postgres.
+    - Revoked tokens are evicted from every worker through the invalidation bus; the cache
+      TTL bounds the staleness if a message is lost.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        lifetime_seconds: int | None = None,
+        *,
+        key_prefix: str,
+        index_key_prefix: str,
+        token_cache: LocalTTLCache[str, str],
+        user_cache: UserSnapshotCache,
+        invalidation_bus: InvalidationBus,
+    ):
+        super().__init__(
+            redis, lifetime_seconds, key_prefix=key_prefix, index_key_prefix=index_key_prefix
+        )
+        self.token_cache = token_cache
+        self.user_cache = user_cache
+        self.invalidation_bus = invalidation_bus
+
+    async def read_token(  # type: ignore[override]
+        self, token: str | None, user_manager: UserManager
+    ) -> User | None:
+        if token is None:
+            return None
+
+        user_id = self.token_cache.get(token)
+        if user_id is None:
+            user_id = await self.redis.get(f"{self.key_prefix}{token}")
+            if user_id is None:
+                return None
+            self.token_cache.set(token, user_id)
+        return await self.user_cache.get_user(user_id, user_manager)
+
+    async def destroy_token(self, token: str, user: User) -> None:
+        await super().destroy_token(token, user)
+        await self.invalidation_bus.publish(BEARER_TOKEN_CACHE_NAMESPACE, token)
+
+
+bearer_token_local_cache: LocalTTLCache[str, str] = LocalTTLCache(
+    maxsize=settings.BEARER_TOKEN_LOCAL_CACHE_MAX_SIZE,
+    ttl_seconds=settings.BEARER_TOKEN_LOCAL_CACHE_TTL_SECONDS,
+)
+invalidation_bus.register(
+    BEARER_TOKEN_CACHE_NAMESPACE,
+    bearer_token_local_cache.delete,
+    on_reset=bearer_token_local_cache.clear,
+)
+
+
+def get_redis_strategy() -> CachedRedisStrategy:
+    return CachedRedisStrategy(
         redis_users_client,
         lifetime_seconds=60 * settings.ACCESS_TOKEN_EXPIRE_MINUTES,
         key_prefix=settings.REDIS_USERS_TOKEN_KEY_PREFIX,
+        index_key_prefix=settings.REDIS_USERS_TOKEN_INDEX_KEY_PREFIX,
+        token_cache=bearer_token_local_cache,
+        user_cache=user_snapshot_cache,
+        invalidation_bus=invalidation_bus,
     )
 
 
@@ -49,20 +182,111 @@ redis_auth_backend = AuthenticationBackend(
 
 # --- JWT Backend ---
 
-# jwt_bearer_transport = BearerTransport(tokenUrl=f"{relative_api_prefix}/jwt/login")
-#
-#
-# def get_jwt_strategy() -> jwtstrategy:
-#     return jwtstrategy(
-#         secret=settings.SECRET_KEY, lifetime_seconds=60 * settings.ACCESS_TOKEN_EXPIRE_MINUTES
-#     )
-#
-#
-# jwt_auth_backend = AuthenticationBackend(
-#     name="jwt",
-#     transport=jwt_bearer_transport,
-#     get_strategy=get_jwt_strategy,
-# )
+
+class SignedTokenStrategy(JWTStrategy[User, ULID]):
+    """
+    `JWTStrategy` whose tokens are verified without any network hop.
+    - The claims carry the user id and flags, a token id and the issue time. An inactive
+      user is rejected from the claims, but they never grant anything: the user is still
+      read from the users cache, which is evicted when a user changes.
+    - Logout and `TokenService` revocations go to the in-memory `TokenRevocationList`.
+    """
+
+    def __init__(
+        self,
+        secret: str,
+        lifetime_seconds: int,
+        *,
+        algorithm: str,
+        revocation_list: TokenRevocationList,
+        user_cache: UserSnapshotCache,
+    ):
+        super().__init__(secret, lifetime_seconds, algorithm=algorithm)
+        self.revocation_list = revocation_list
+        self.user_cache = user_cache
+
+    def decode(self, token: str) -> dict[str, Any] | None:
+        try:
+            claims = decode_jwt(
+                token, self.decode_key, self.token_audience, algorithms=[self.algorithm]
+            )
+        except jwt.PyJWTError:
+            return None
+        if not {"sub", "jti", "iat", "exp"} <= claims.keys():
+            return None
+        return claims
+
+    async def read_token(  # type: ignore[override]
+        self, token: str | None, user_manager: UserManager
+    ) -> User | None:
+        if token is None:
+            return None
+
+        claims = self.decode(token)
+        if claims is None or not claims.get("is_active", True):
+            return None
+        if self.revocation_list.is_revoked(claims["jti"], claims["sub"], claims["iat"]):
+            return None
+        return await self.user_cache.get_user(claims["sub"], user_manager)
+
+    async def write_token(self, user: User) -> str:
+        claims = {
+            "sub": str(user.id),
+            "aud": self.token_audience,
+            "jti": secrets.token_urlsafe(16),
+            "iat": time.time(),
+            "is_active": user.is_active,
+            "is_superuser": user.is_superuser,
+            "is_verified": user.is_verified,
+        }
+        return generate_jwt(
+            claims, self.encode_key, self.lifetime_seconds, algorithm=self.algorithm
+        )
+
+    async def destroy_token(self, token: str, user: User) -> None:  # noqa: ARG002
+        await self.revoke(token)
+
+    async def revoke(self, token: str) -> None:
+        claims = self.decode(token)
+        if claims is not None:
+            await self.revocation_list.revoke(claims["jti"], claims["exp"])
+
+
+jwt_bearer_transport = BearerTransport(tokenUrl=f"{relative_api_prefix}/auth/login")
+token_revocation_list = TokenRevocationList(
+    redis_users_client,
+    key_prefix=settings.REDIS_USERS_REVOKED_TOKENS_KEY_PREFIX,
+    lifetime_seconds=60 * settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+    invalidation_bus=invalidation_bus,
+)
+invalidation_bus.register(
+    REVOKED_TOKEN_NAMESPACE,
+    token_revocation_list.add_revoked_tokens,
+    on_reset=token_revocation_list.request_reload,
+)
+invalidation_bus.register(REVOKED_USER_TOKENS_NAMESPACE, token_revocation_list.add_revoked_users)
+
+
+def get_jwt_strategy() -> SignedTokenStrategy:
+    return SignedTokenStrategy(
+        settings.SECRET_KEY,
+        lifetime_seconds=60 * settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+        algorithm=settings.JWT_ALGORITHM,
+        revocation_list=token_revocation_list,
+        user_cache=user_snapshot_cache,
+    )
+
+
+jwt_auth_backend = AuthenticationBackend(
+    name="jwt",
+    transport=jwt_bearer_transport,
+    get_strategy=get_jwt_strategy,
+)
+
+# the backend issuing and reading the bearer tokens
+bearer_auth_backend = (
+    jwt_auth_backend if settings.BEARER_AUTH_BACKEND == "jwt" else redis_auth_backend
+)
 
 # --- API Keys Backend ---
 
@@ -74,6 +298,30 @@ class APIKeyTransport(Transport):
         self.scheme = APIKeyHeader(name=name, auto_error=False)
 
 
+class CachedAPIKey(NamedTuple):
+    owner_id: str
+    # sha256 of the full API key, so that a cache hit still proves knowledge of the secret
+    fingerprint: str
+
+
+def fingerprint_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+# Read the cached owner and slide the TTL of an API key in a single round-trip.
+# KEYS[1]: cache key, ARGV[1]: lifetime in seconds, ARGV[2]: TTL below which it is refreshed
+READ_CACHED_API_KEY_SCRIPT = """
+local cached = redis.call('HMGET', KEYS[1], 'owner_id', 'fingerprint')
+if not cached[1] or not cached[2] then
+    return nil
+end
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return cached
+"""
+
+
 class APIKeyStrategy(Strategy[User, ULID]):
     def __init__(
         self,
@@ -81,14 +329,27 @@ class APIKeyStrategy(Strategy[User, ULID]):
         redis: aioredis.Redis,
         lifetime_seconds: int,
         key_prefix: str,
+        local_cache: LocalTTLCache[str, CachedAPIKey],
+        usage_recorder: APIKeyUsageRecorder,
+        shield: APIKeyShield,
+        user_cache: UserSnapshotCache,
+        recent_writes: RecentWrites,
     ):
         self.session_factory = session_factory
-        self.hasher = Argon2Hasher()
         self.redis = redis
         self.lifetime_seconds = lifetime_seconds
         self.key_prefix = key_prefix
+        self.local_cache = local_cache
+        self.usage_recorder = usage_recorder
+        self.shield = shield
+        self.user_cache = user_cache
+        self.recent_writes = recent_writes
+        self.read_cached_api_key = redis.register_script(READ_CACHED_API_KEY_SCRIPT)
 
-    async def read_token(self, token: str | None, user_manager: UserManager) -> User | None:  # type: ignore[override]  # noqa: C901
+    async def read_token(  # type: ignore[override]
+        self, token: str | None, user_manager: UserManager, client: str = ""
+    ) -> User | None:
+        # `client` identifies the caller for the failed verifications lockout
         api_key = token
         if api_key is None:
             return None
@@ -98,46 +359,116 @@ class APIKeyStrategy(Strategy[User, ULID]):
         except ValueError:
             raise InvalidAPIKeyError(key_id) from None
 
+        fingerprint = fingerprint_api_key(api_key)
+        cached = self.local_cache.get(key_id)
+        if cached is None:
+            cached = await self._read_cached_api_key(key_id)
+            if cached is not None:
+                self.local_cache.set(key_id, cached)
+        if cached is not None and secrets.compare_digest(cached.fingerprint, fingerprint):
+            self.usage_recorder.record(key_id)
+            return await self.user_cache.get_user(cached.owner_id, user_manager)
+
+        if self.shield.is_rejected(key_id, fingerprint, client):
+            raise InvalidAPIKeyError(key_id)
+
+        db_key = await self._read_api_key(key_id)
+        if not db_key:
+            self.shield.record_unknown(key_id)
+            raise InvalidAPIKeyError(key_id)
+        verified, updated_key_hash = await api_key_hasher.verify_and_update(
+            key_secret, db_key.key_hash
+        )
+        if not verified:
+            self.shield.record_failure(key_id, fingerprint, client)
+            raise InvalidAPIKeyError(key_id)
+        if updated_key_hash is not None:
+            await self._update_key_hash(db_key.id, db_key.key_hash, updated_key_hash)
+
+        self.usage_recorder.record(key_id)
+
+        cached = CachedAPIKey(owner_id=str(db_key.owner_id), fingerprint=fingerprint)
         cache_key = f"{self.key_prefix}{key_id}"
-        ttl = await self.redis.ttl(cache_key)
-        if ttl > 0:
-            if ttl < 60:  # noqa: PLR2004
-                await self.redis.expire(cache_key, self.lifetime_seconds)
-            cached = await self.redis.hgetall(cache_key)  # type: ignore[misc]
-            if cached:
-                try:
-                    user_id = user_manager.parse_id(cached["owner_id"])
-                except (exceptions.UserNotExists, exceptions.InvalidID, KeyError):
-                    return None
-                else:
-                    return await user_manager.get(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(cache_key, mapping=cached._asdict())
+            pipe.expire(cache_key, self.lifetime_seconds)
+            await pipe.execute()
+        self.local_cache.set(key_id, cached)
 
-        async with self.session_factory() as session:
-            statement = (
-                select(APIKey).where(APIKey.revoked == False).where(APIKey.key_id == key_id)  # noqa: E712
-            )
-            result = await session.exec(statement)
-            db_key = result.first()
-            if not db_key or not self.hasher.verify(key_secret, db_key.key_hash):
-                raise InvalidAPIKeyError(key_id)
+        return await self.user_cache.get_user(cached.owner_id, user_manager)
 
-            db_key.last_used = datetime.now(timezone.utc)
-            session.add(db_key)
-            await session.commit()
+    async def _read_api_key(self, key_id: str) -> Row[tuple[ULID, ULID, str]] | None:
+        # the columns needed to verify the key, not the key with its owner
+        statement = (
+            select(col(APIKey.id), col(APIKey.owner_id), col(APIKey.key_hash))
+            .where(col(APIKey.revoked) == False)  # noqa: E712
+            .where(col(APIKey.key_id) == key_id)
+        )
+        async with self.session_factory() as session:
+            # a lagging replica would cache a key revoked or updated recently
+            with replica_reads(session, enabled=key_id not in self.recent_writes):
+                db_key = (await session.exec(statement)).first()
+                if db_key is None and reads_from_replica(session):
+                    # a key created within the replication lag may not be on the replica yet
+                    with replica_reads(session, enabled=False):
+                        db_key = (await session.exec(statement)).first()
+        return cast("Row[tuple[ULID, ULID, str]] | None", db_key)
 
-            metadata = {"owner_id": str(db_key.owner_id)}
-            await self.redis.hset(cache_key, mapping=metadata)  # type: ignore[misc]
-            await self.redis.expire(cache_key, self.lifetime_seconds)
+    async def _read_cached_api_key(self, key_id: str) -> CachedAPIKey | None:
+        cached = await self.read_cached_api_key(
+            keys=[f"{self.key_prefix}{key_id}"], args=[self.lifetime_seconds, 60]
+        )
+        if not cached:
+            return None
+        owner_id, fingerprint = cached
+        return CachedAPIKey(owner_id=owner_id, fingerprint=fingerprint)
 
-            try:
-                user_id = user_manager.parse_id(db_key.owner_id)
-            except (exceptions.UserNotExists, exceptions.InvalidID, KeyError):
-                return None
-            else:
-                return await user_manager.get(user_id)
+    async def _update_key_hash(self, api_key_id: ULID, old_key_hash: str, key_hash: str) -> None:
+        # one-off upgrade of a key hashed with the previous scheme
+        statement = (
+            update(APIKey)
+            .where(col(APIKey.id) == api_key_id)
+            .where(col(APIKey.key_hash) == old_key_hash)
+            .values(key_hash=key_hash)
+        )
+        async with self.session_factory() as session:
+            await session.exec(statement)  # type: ignore[call-overload]
+            await session.commit()
 
 
 api_key_transport = APIKeyTransport(name="X-API-Key")  # type: ignore[abstract]
+api_key_local_cache: LocalTTLCache[str, CachedAPIKey] = LocalTTLCache(
+    maxsize=settings.API_KEY_LOCAL_CACHE_MAX_SIZE,
+    ttl_seconds=settings.API_KEY_LOCAL_CACHE_TTL_SECONDS,
+)
+invalidation_bus.register(
+    API_KEY_CACHE_NAMESPACE, api_key_local_cache.delete, on_reset=api_key_local_cache.clear
+)
+recent_api_key_writes = RecentWrites(
+    maxsize=settings.POSTGRES_REPLICA_RECENT_WRITES_MAX_SIZE,
+    ttl_seconds=replica_set.staleness_bound_seconds,
+)
+invalidation_bus.register(
+    API_KEY_CACHE_NAMESPACE, recent_api_key_writes.add, on_reset=recent_api_key_writes.reset
+)
+api_key_usage_recorder = APIKeyUsageRecorder(
+    AsyncSessionMaker,
+    flush_interval_seconds=settings.API_KEY_LAST_USED_FLUSH_INTERVAL_SECONDS,
+    max_staleness_seconds=settings.API_KEY_LAST_USED_MAX_STALENESS_SECONDS,
+    max_pending=settings.API_KEY_LAST_USED_MAX_PENDING,
+)
+api_key_shield = APIKeyShield(
+    AsyncSessionMaker,
+    negative_cache_ttl_seconds=settings.API_KEY_NEGATIVE_CACHE_TTL_SECONDS,
+    negative_cache_max_size=settings.API_KEY_NEGATIVE_CACHE_MAX_SIZE,
+    max_failures=settings.API_KEY_MAX_FAILED_VERIFICATIONS,
+    bloom_filter_capacity=settings.API_KEY_BLOOM_FILTER_CAPACITY,
+    bloom_filter_error_rate=settings.API_KEY_BLOOM_FILTER_ERROR_RATE,
+    rebuild_interval_seconds=settings.API_KEY_BLOOM_FILTER_REBUILD_INTERVAL_SECONDS,
+)
+invalidation_bus.register(
+    API_KEY_CREATED_NAMESPACE, api_key_shield.add, on_reset=api_key_shield.reset
+)
 
 
 def get_api_key_strategy() -> APIKeyStrategy:
@@ -146,6 +477,11 @@ def get_api_key_strategy() -> APIKeyStrategy:
         redis_users_client,
         lifetime_seconds=60 * settings.API_KEY_EXPIRE_MINUTES,
         key_prefix=settings.REDIS_USERS_APIKEY_KEY_PREFIX,
+        local_cache=api_key_local_cache,
+        usage_recorder=api_key_usage_recorder,
+        shield=api_key_shield,
+        user_cache=user_snapshot_cache,
+        recent_writes=recent_api_key_writes,
     )
 
 
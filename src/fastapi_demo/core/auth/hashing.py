@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import hashlib
+import hmac
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Literal, TypeVar
+
+from pwdlib import PasswordHash
+from pwdlib.exceptions import UnknownHashError
+from pwdlib.hashers.argon2 import Argon2Hasher
+from pwdlib.hashers.base import ensure_bytes, ensure_str
+
+from fastapi_demo.core.config import settings
+
+T = TypeVar("T")
+
+
+class HashingExecutor:
+    """
+    Run CPU-bound hashing (Argon2 verifications and hashes) off the event loop.
+    - At most `max_concurrency` calls are handed to the pool at once, the others wait
+      on a semaphore and are reported as queued.
+    - Argon2 releases the GIL, so the thread pool scales across cores; the process pool
+      is there for hashers that don't.
+    """
+
+    def __init__(
+        self,
+        kind: Literal["thread", "process"] = "thread",
+        max_workers: int | None = None,
+        max_concurrency: int = 16,
+    ):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor: Executor | None = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="hashing"
+                )
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_executor = HashingExecutor(
+    kind=settings.HASHING_EXECUTOR,
+    max_workers=settings.HASHING_MAX_WORKERS,
+    max_concurrency=settings.HASHING_MAX_CONCURRENCY,
+)
+
+
+class HMACSHA256Hasher:
+    """
+    A pwdlib hasher for high-entropy secrets such as API keys: HMAC-SHA256 keyed with a
+    server-side pepper and verified in constant time.
+    It is only safe because the secrets can't be guessed, never use it for passwords.
+    """
+
+    prefix = "$hmac-sha256$"
+
+    def __init__(self, pepper: str | bytes):
+        self.pepper = ensure_bytes(pepper)
+
+    @classmethod
+    def identify(cls, hash: str | bytes) -> bool:  # noqa: A002
+        return ensure_str(hash).startswith(cls.prefix)
+
+    def hash(self, password: str | bytes, *, salt: bytes | None = None) -> str:  # noqa: ARG002
+        digest = hmac.new(self.pepper, ensure_bytes(password), hashlib.sha256).hexdigest()
+        return f"{self.prefix}{digest}"
+
+    def verify(self, password: str | bytes, hash: str | bytes) -> bool:  # noqa: A002
+        return hmac.compare_digest(self.hash(password), ensure_str(hash))
+
+    def check_needs_rehash(self, hash: str | bytes) -> bool:  # noqa: A002, ARG002, PLR6301
+        return False
+
+
+class APIKeyHasher:
+    """
+    Hash and verify API key secrets with the configured scheme.
+    - Hashes made with the other scheme are still verified, and a new hash is returned when
+      they should be upgraded.
+    - Without a pepper, HMAC-SHA256 hashes can't be verified and only Argon2 is used.
+    - Only Argon2 goes through the hashing executor: HMAC-SHA256 is cheaper than the hop.
+    """
+
+    def __init__(self, scheme: Literal["argon2", "hmac-sha256"], pepper: str | bytes | None):
+        argon2_hasher = Argon2Hasher()
+        self.hmac_hasher = HMACSHA256Hasher(pepper) if pepper else None
+        if self.hmac_hasher is None:
+            self.password_hash = PasswordHash((argon2_hasher,))
+        elif scheme == "hmac-sha256":
+            self.password_hash = PasswordHash((self.hmac_hasher, argon2_hasher))
+        else:
+            self.password_hash = PasswordHash((argon2_hasher, self.hmac_hasher))
+
+    @property
+    def _hmac_is_current(self) -> bool:
+        return self.password_hash.current_hasher is self.hmac_hasher
+
+    async def hash(self, secret: str) -> str:
+        if self._hmac_is_current:
+            return self.password_hash.hash(secret)
+        return await hashing_executor.run(self.password_hash.hash, secret)
+
+    async def verify_and_update(self, secret: str, key_hash: str) -> tuple[bool, str | None]:
+        try:
+            if self._hmac_is_current and HMACSHA256Hasher.identify(key_hash):
+                return self.password_hash.verify_and_update(secret, key_hash)
+            return await hashing_executor.run(
+                self.password_hash.verify_and_update, secret, key_hash
+            )
+        except UnknownHashError:
+            return False, None
+
+
+api_key_hasher = APIKeyHasher(
+    scheme=settings.API_KEY_HASH_SCHEME,
+    pepper=settings.API_KEY_HASH_PEPPER,
+)
@@ -4,10 +4,14 @@ from collections.abc import AsyncGenerator
 from typing import Annotated, Any
 
 from fastapi import Depends, Request
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_users import BaseUserManager, InvalidPasswordException, exceptions
 from fastapi_users_db_sqlmodel import SQLModelUserDatabaseAsync
 from ulid import ULID
 
+from fastapi_demo.core.auth.hashing import hashing_executor
+from fastapi_demo.core.auth.redis import invalidation_bus
+from fastapi_demo.core.auth.user_cache import USER_CACHE_NAMESPACE
 from fastapi_demo.core.celery.tasks.emails import (
     send_reset_password_email,
     send_verify_account_email,
@@ -54,6 +58,53 @@ class UserManager(ULIDIDMixin, BaseUserManager[User, ULID]):
     ):
         super().__init__(user_db, **kwargs)
 
+    async def create(
+        self,
+        user_create: UserCreate,  # type: ignore[override]
+        safe: bool = False,
+        request: Request | None = None,
+    ) -> User:
+        # same as `BaseUserManager.create` but the password is hashed off the event loop
+        await self.validate_password(user_create.password, user_create)
+
+        existing_user = await self.user_db.get_by_email(user_create.email)
+        if existing_user is not None:
+            raise exceptions.UserAlreadyExists()
+
+        user_dict = (
+            user_create.create_update_dict() if safe else user_create.create_update_dict_superuser()
+        )
+        password = user_dict.pop("password")
+        user_dict["hashed_password"] = await hashing_executor.run(
+            self.password_helper.hash, password
+        )
+
+        created_user = await self.user_db.create(user_dict)
+
+        await self.on_after_register(created_user, request)
+
+        return created_user
+
+    async def authenticate(self, credentials: OAuth2PasswordRequestForm) -> User | None:
+        # same as `BaseUserManager.authenticate` but the password is verified off the event loop
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Run the hasher to mitigate timing attack
+            await hashing_executor.run(self.password_helper.hash, credentials.password)
+            return None
+
+        verified, updated_password_hash = await hashing_executor.run(
+            self.password_helper.verify_and_update, credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        # Update password hash to a more robust one if needed
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+
+        return user
+
     async def validate_password(  # noqa: PLR6301
         self,
         password: str,
@@ -85,6 +136,28 @@ class UserManager(ULIDIDMixin, BaseUserManager[User, ULID]):
         user_data = {"email": user.email, "first_name": user.first_name}
         send_welcome_email.delay(user_data)
 
+    async def on_after_update(
+        self,
+        user: User,
+        update_dict: dict[str, Any],  # noqa: ARG002
+        request: Request | None = None,  # noqa: ARG002
+    ) -> None:
+        await self._invalidate_cached_user(user)
+
+    async def on_after_verify(self, user: User, request: Request | None = None) -> None:  # noqa: ARG002
+        await self._invalidate_cached_user(user)
+
+    async def on_after_reset_password(self, user: User, request: Request | None = None) -> None:  # noqa: ARG002
+        await self._invalidate_cached_user(user)
+
+    async def on_after_delete(self, user: User, request: Request | None = None) -> None:  # noqa: ARG002
+        await self._invalidate_cached_user(user)
+
+    @staticmethod
+    async def _invalidate_cached_user(user: User) -> None:
+        # evict the user from the authentication caches of every worker
+        await invalidation_bus.publish(USER_CACHE_NAMESPACE, str(user.id))
+
     async def on_after_forgot_password(
         self,
         user: User,
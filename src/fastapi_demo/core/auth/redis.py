@@ -0,0 +1,13 @@
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.utils.pubsub import InvalidationBus
+from fastapi_demo.core.utils.redis import redis_pools
+
+redis_users_client = redis_pools.client("users", db=settings.REDIS_USERS_DB)
+# the subscription blocks on reads and holds its connection for the life of the worker:
+# keep it out of the pool used by the requests
+invalidation_bus = InvalidationBus(
+    redis_pools.client(
+        "users_pubsub", db=settings.REDIS_USERS_DB, max_connections=4, socket_timeout=None
+    ),
+    channel=settings.REDIS_USERS_INVALIDATION_CHANNEL,
+)
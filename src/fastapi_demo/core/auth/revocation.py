@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+
+import redis.asyncio as aioredis
+
+from fastapi_demo.core.utils.pubsub import InvalidationBus
+
+logger = logging.getLogger(__name__)
+
+REVOKED_TOKEN_NAMESPACE = "revoked_token"  # noqa: S105
+REVOKED_USER_TOKENS_NAMESPACE = "revoked_user_tokens"
+
+
+class TokenRevocationList:
+    """
+    Revocations of the signed (stateless) access tokens, checked in memory.
+    - Revoked token ids are kept until the tokens expire, and a per-user timestamp revokes
+      every token issued to a user before it, for as long as such tokens can be valid.
+    - Both are stored in Redis sorted sets, loaded when the worker starts and when the
+      invalidation bus reconnects, and kept in sync through the bus in between.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        *,
+        key_prefix: str,
+        lifetime_seconds: int,
+        invalidation_bus: InvalidationBus,
+    ):
+        self.redis = redis
+        self.tokens_key = f"{key_prefix}tokens"
+        self.users_key = f"{key_prefix}users"
+        self.lifetime_seconds = lifetime_seconds
+        self.invalidation_bus = invalidation_bus
+        # token id -> expiry timestamp
+        self._revoked_tokens: dict[str, float] = {}
+        # user id -> tokens issued before this timestamp are revoked
+        self._revoked_before: dict[str, float] = {}
+        self._reload_requested = asyncio.Event()
+
+    def is_revoked(self, token_id: str, user_id: str, issued_at: float) -> bool:
+        if token_id in self._revoked_tokens:
+            return True
+        revoked_before = self._revoked_before.get(user_id)
+        return revoked_before is not None and issued_at <= revoked_before
+
+    async def revoke(self, token_id: str, expires_at: float) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.tokens_key, {token_id: expires_at})
+            pipe.zremrangebyscore(self.tokens_key, "-inf", time.time())
+            await pipe.execute()
+        await self.invalidation_bus.publish(REVOKED_TOKEN_NAMESPACE, f"{token_id}:{expires_at}")
+
+    async def revoke_user(self, user_id: str) -> None:
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.users_key, {user_id: now})
+            pipe.zremrangebyscore(self.users_key, "-inf", now - self.lifetime_seconds)
+            await pipe.execute()
+        await self.invalidation_bus.publish(REVOKED_USER_TOKENS_NAMESPACE, f"{user_id}:{now}")
+
+    def add_revoked_tokens(self, *entries: str) -> None:
+        for entry in entries:
+            token_id, expires_at = entry.rsplit(":", maxsplit=1)
+            self._revoked_tokens[token_id] = float(expires_at)
+
+    def add_revoked_users(self, *entries: str) -> None:
+        for entry in entries:
+            user_id, revoked_before = entry.rsplit(":", maxsplit=1)
+            self._revoked_before[user_id] = max(
+                float(revoked_before), self._revoked_before.get(user_id, 0.0)
+            )
+
+    def request_reload(self) -> None:
+        # revocations may have been missed while the bus was disconnected
+        self._reload_requested.set()
+
+    async def reload(self) -> None:
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrangebyscore(self.tokens_key, now, "+inf", withscores=True)
+            pipe.zrangebyscore(self.users_key, now - self.lifetime_seconds, "+inf", withscores=True)
+            revoked_tokens, revoked_users = await pipe.execute()
+        # revocations received while loading are kept
+        self._revoked_tokens = {**self._revoked_tokens, **dict(revoked_tokens)}
+        self._revoked_before = {**self._revoked_before, **dict(revoked_users)}
+        self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        self._revoked_tokens = {
+            token_id: expires_at
+            for token_id, expires_at in self._revoked_tokens.items()
+            if expires_at > now
+        }
+        self._revoked_before = {
+            user_id: revoked_before
+            for user_id, revoked_before in self._revoked_before.items()
+            if revoked_before > now - self.lifetime_seconds
+        }
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._reload_requested.wait(), timeout=60)
+            if self._reload_requested.is_set():
+                self._reload_requested.clear()
+                try:
+                    await self.reload()
+                except Exception:
+                    logger.exception("Failed to reload the revoked tokens")
+                    self._reload_requested.set()
+                    await asyncio.sleep(1)
+            else:
+                self._prune(time.time())
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator[None]:
+        # don't accept any token before the revocations are known
+        await self.reload()
+        self._reload_requested.clear()
+        task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
@@ -0,0 +1,162 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ulid import ULID
+
+from fastapi_demo.core.models.users import APIKey
+from fastapi_demo.core.utils.bloom import BloomFilter
+from fastapi_demo.core.utils.cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# between the worker building the Bloom filter and the one creating a key
+CLOCK_SKEW_SECONDS = 60
+
+
+def key_id_created_at(key_id: str) -> float | None:
+    """Creation time of a key id ending with a ULID, None for the ids issued before them"""
+    try:
+        return float(ULID.from_str(key_id.rpartition("-")[2]).timestamp)
+    except ValueError:
+        return None
+
+
+class APIKeyShield:
+    """
+    Reject API keys that can't be valid before they cost a database query or a hash
+    verification.
+    - A Bloom filter of the issued key ids, rebuilt from the `apikey` table every
+      `rebuild_interval_seconds`, rejects key ids that were never issued. It is not used
+      until the first build is done.
+    - Key ids embed their creation time: ids created after the filter was built, which it
+      may miss when their `api_key_created` message was lost, are looked up in the database.
+    - A short-lived negative cache remembers unknown key ids and failed verifications. A
+      failed API key is remembered by its fingerprint, so the right secret is never rejected.
+    - A key id failing `max_failures` verifications from a client within
+      `negative_cache_ttl_seconds` of its first failure is locked for that client until then.
+      Other clients and the keys already in the API keys cache are not affected.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        *,
+        negative_cache_ttl_seconds: float,
+        negative_cache_max_size: int,
+        max_failures: int,
+        bloom_filter_capacity: int,
+        bloom_filter_error_rate: float,
+        rebuild_interval_seconds: float,
+    ):
+        self.session_factory = session_factory
+        self.max_failures = max_failures
+        self.bloom_filter_capacity = bloom_filter_capacity
+        self.bloom_filter_error_rate = bloom_filter_error_rate
+        self.rebuild_interval_seconds = rebuild_interval_seconds
+        self._unknown_key_ids: LocalTTLCache[str, bool] = LocalTTLCache(
+            negative_cache_max_size, negative_cache_ttl_seconds
+        )
+        # keyed by the fingerprint of the full API key
+        self._failed_api_keys: LocalTTLCache[str, bool] = LocalTTLCache(
+            negative_cache_max_size, negative_cache_ttl_seconds
+        )
+        # keyed by the key id and the client, valued by the count and its expiry
+        self._failures: LocalTTLCache[tuple[str, str], tuple[int, float]] = LocalTTLCache(
+            negative_cache_max_size, negative_cache_ttl_seconds
+        )
+        self._bloom_filter: BloomFilter | None = None
+        self._built_at = 0.0
+        self._added_while_rebuilding: set[str] | None = None
+        self._rebuild_requested = asyncio.Event()
+
+    def is_rejected(self, key_id: str, fingerprint: str, client: str) -> bool:
+        if (
+            self._bloom_filter is not None
+            and key_id not in self._bloom_filter
+            and not self._created_since_build(key_id)
+        ):
+            return True
+        if key_id in self._unknown_key_ids or fingerprint in self._failed_api_keys:
+            return True
+        failures, _ = self._failures.get((key_id, client)) or (0, 0.0)
+        return failures >= self.max_failures
+
+    def record_unknown(self, key_id: str) -> None:
+        self._unknown_key_ids.set(key_id, True)
+
+    def record_failure(self, key_id: str, fingerprint: str, client: str) -> None:
+        self._failed_api_keys.set(fingerprint, True)
+        now = time.monotonic()
+        # the lock expires with the first failure, further failures don't extend it
+        failures, expires_at = self._failures.get((key_id, client)) or (
+            0,
+            now + self._failures.ttl_seconds,
+        )
+        self._failures.set((key_id, client), (failures + 1, expires_at), expires_at - now)
+
+    def _created_since_build(self, key_id: str) -> bool:
+        created_at = key_id_created_at(key_id)
+        return created_at is not None and created_at >= self._built_at - CLOCK_SKEW_SECONDS
+
+    def add(self, *key_ids: str) -> None:
+        self._unknown_key_ids.delete(*key_ids)
+        if self._added_while_rebuilding is not None:
+            self._added_while_rebuilding.update(key_ids)
+        if self._bloom_filter is not None:
+            for key_id in key_ids:
+                self._bloom_filter.add(key_id)
+
+    def reset(self) -> None:
+        # additions may have been missed: stop trusting the filter until it is rebuilt
+        self._bloom_filter = None
+        self._rebuild_requested.set()
+
+    async def rebuild(self) -> None:
+        self._added_while_rebuilding = set()
+        built_at = time.time()
+        try:
+            async with self.session_factory() as session:
+                result = await session.exec(
+                    select(APIKey.key_id).where(APIKey.revoked == False)  # noqa: E712
+                )
+                key_ids = result.all()
+            bloom_filter = BloomFilter.from_items(
+                key_ids,
+                capacity=max(self.bloom_filter_capacity, 2 * len(key_ids)),
+                error_rate=self.bloom_filter_error_rate,
+            )
+            for key_id in self._added_while_rebuilding:
+                bloom_filter.add(key_id)
+            self._bloom_filter = bloom_filter
+            self._built_at = built_at
+        finally:
+            self._added_while_rebuilding = None
+
+    async def _run(self) -> None:
+        while True:
+            self._rebuild_requested.clear()
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("Failed to rebuild the API keys Bloom filter")
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._rebuild_requested.wait(), timeout=self.rebuild_interval_seconds
+                )
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator[None]:
+        task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
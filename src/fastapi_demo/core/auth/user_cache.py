@@ -0,0 +1,78 @@
+from typing import TYPE_CHECKING, Any
+
+from fastapi_users import exceptions
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ulid import ULID
+
+from fastapi_demo.core.db.replicas import RecentWrites, reads_from_replica, replica_reads
+from fastapi_demo.core.models.users import User
+from fastapi_demo.core.utils.cache import LocalTTLCache
+
+if TYPE_CHECKING:
+    from fastapi_demo.core.auth.manager import UserManager
+
+USER_CACHE_NAMESPACE = "user"
+
+
+class UserSnapshotCache:
+    """
+    Per-worker cache of the users loaded by the authentication strategies.
+    - Users are kept as plain column values and rebuilt as detached instances on every hit,
+      so requests never share an ORM object and the user can still be added to a session
+      to be updated.
+    - Relationships are not cached: they can't be lazy loaded from a cached user.
+    - Entries are evicted through the invalidation bus when a user changes.
+    - Missing users are loaded in a session of `session_factory`, from a read replica unless
+      they changed recently: a lagging replica would put the previous version back in the
+      cache.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl_seconds: float,
+        *,
+        session_factory: async_sessionmaker[AsyncSession],
+        recent_writes: RecentWrites,
+    ):
+        self._snapshots: LocalTTLCache[str, dict[str, Any]] = LocalTTLCache(maxsize, ttl_seconds)
+        self.session_factory = session_factory
+        self.recent_writes = recent_writes
+
+    async def get_user(self, user_id: Any, user_manager: "UserManager") -> User | None:
+        try:
+            parsed_id = user_manager.parse_id(user_id)
+        except exceptions.InvalidID:
+            return None
+
+        snapshot = self._snapshots.get(str(parsed_id))
+        if snapshot is not None:
+            cached = User(**snapshot)
+            make_transient_to_detached(cached)
+            return cached
+
+        user = await self._load_user(parsed_id)
+        if user is not None:
+            self.set(user)
+        return user
+
+    async def _load_user(self, user_id: ULID) -> User | None:
+        async with self.session_factory() as session:
+            with replica_reads(session, enabled=str(user_id) not in self.recent_writes):
+                user = await session.get(User, user_id)
+                if user is None and reads_from_replica(session):
+                    # a user created within the replication lag may not be on the replica yet
+                    with replica_reads(session, enabled=False):
+                        user = await session.get(User, user_id)
+        return user
+
+    def set(self, user: User) -> None:
+        self._snapshots.set(str(user.id), user.model_dump())
+
+    def delete(self, *user_ids: str) -> None:
+        self._snapshots.delete(*user_ids)
+
+    def clear(self) -> None:
+        self._snapshots.clear()
@@ -1,36 +1,180 @@
-from typing import Annotated
+from collections.abc import Callable
+from inspect import Parameter, Signature
+from typing import Annotated, Any, NamedTuple, cast
 
 # from fastapi import Request
 from fastapi import Depends, HTTPException, Request, status
+from fastapi.security.utils import get_authorization_scheme_param
 from fastapi_users import FastAPIUsers
-from fastapi_users.authentication import AuthenticationBackend
+from fastapi_users.authentication import AuthenticationBackend, Strategy
+from fastapi_users.authentication.authenticator import (
+    Authenticator,
+    EnabledBackendsDependency,
+    name_to_variable_name,
+)
 from ulid import ULID
 
-from fastapi_demo.core.auth.backends import api_key_backend, redis_auth_backend
+from fastapi_demo.core.auth.backends import (
+    APIKeyStrategy,
+    api_key_backend,
+    api_key_transport,
+    bearer_auth_backend,
+    redis_bearer_transport,
+)
 from fastapi_demo.core.auth.manager import get_user_manager
 from fastapi_demo.core.config import settings
+from fastapi_demo.core.exceptions import InvalidAPIKeyError
 from fastapi_demo.core.models.users import User
+from fastapi_demo.core.utils.database import (
+    get_request_session_context,
+    get_user_db_context,
+    get_user_manager_context,
+)
+from fastapi_demo.core.utils.network import get_client_ip
 
 
 async def get_enabled_backends(request: Request) -> list[AuthenticationBackend]:  # noqa: RUF029
     """Return the enabled backends based on the routes"""
     request_path = request.url.path.split(settings.API_PREFIX.rstrip("/"))[-1]
     if request_path.startswith(("/auth/", "/users/")):
-        return [redis_auth_backend]
-    return [api_key_backend, redis_auth_backend]
+        return [bearer_auth_backend]
+    return [api_key_backend, bearer_auth_backend]
+
+
+# --- Principal ---
+
+
+class Principal(NamedTuple):
+    user: User | None
+    # the credentials the user was authenticated with
+    token: str | None = None
+    # raised when the principal is used, so that it goes through the exception handlers
+    error: InvalidAPIKeyError | None = None
+
+
+ANONYMOUS = Principal(user=None)
+
+
+async def resolve_principal(request: Request) -> Principal:
+    """
+    Authenticate a request with the backend matching its credentials.
+    - A bearer token only goes to the bearer backend, an `X-API-Key` only to the API keys
+      backend, and requests without credentials are anonymous without any lookup.
+    - As with `fastapi_users`, the bearer token wins when both are sent and valid.
+    """
+    scheme, token = get_authorization_scheme_param(request.headers.get("authorization"))
+    credentials = {
+        bearer_auth_backend: token if scheme.lower() == "bearer" and token else None,
+        api_key_backend: request.headers.get(api_key_transport.scheme.model.name),
+    }
+    if settings.USE_DYNAMICALLY_ENABLED_AUTH_BACKENDS:
+        enabled_backends = await get_enabled_backends(request)
+        credentials = {
+            backend: value for backend, value in credentials.items() if backend in enabled_backends
+        }
+    if not any(credentials.values()):
+        return ANONYMOUS
+
+    async with (
+        get_request_session_context(request) as session,
+        get_user_db_context(session) as user_db,
+        get_user_manager_context(user_db) as user_manager,
+    ):
+        for backend, value in credentials.items():
+            if not value:
+                continue
+            strategy = cast(Strategy[User, ULID], backend.get_strategy())
+            try:
+                if isinstance(strategy, APIKeyStrategy):
+                    user = await strategy.read_token(value, user_manager, get_client_ip(request))
+                else:
+                    user = await strategy.read_token(value, user_manager)
+            except InvalidAPIKeyError as exc:
+                return Principal(user=None, error=exc)
+            if user:
+                return Principal(user=user, token=value)
+    return ANONYMOUS
+
+
+async def get_principal(request: Request) -> Principal:
+    # set by `AuthenticationMiddleware`, resolved here when it isn't installed
+    principal: Principal | None = getattr(request.state, "principal", None)
+    if principal is None:
+        principal = request.state.principal = await resolve_principal(request)
+    return principal
+
+
+class PrincipalAuthenticator(Authenticator[User, ULID]):
+    """
+    `Authenticator` of the fastapi-users routers, such as `/users/me` or `/auth/logout`,
+    reading the principal resolved by `AuthenticationMiddleware` instead of resolving the
+    user again.
+    - The transports stay in the dependencies signature for the OpenAPI security schemes.
+    """
+
+    def _get_dependency_signature(
+        self,
+        get_enabled_backends: EnabledBackendsDependency[User, ULID] | None = None,  # noqa: ARG002
+    ) -> Signature:
+        # the enabled backends are already applied by `resolve_principal`
+        parameters = [Parameter("request", Parameter.POSITIONAL_OR_KEYWORD, annotation=Request)]
+        parameters += [
+            Parameter(
+                name_to_variable_name(backend.name),
+                Parameter.POSITIONAL_OR_KEYWORD,
+                default=Depends(cast(Callable[..., Any], backend.transport.scheme)),
+            )
+            for backend in self.backends
+        ]
+        return Signature(parameters)
+
+    async def _authenticate(  # type: ignore[override] # noqa: PLR6301
+        self,
+        *args: Any,  # noqa: ARG002
+        request: Request,
+        optional: bool = False,
+        active: bool = False,
+        verified: bool = False,
+        superuser: bool = False,
+        **kwargs: Any,  # noqa: ARG002
+    ) -> tuple[User | None, str | None]:
+        principal = await get_principal(request)
+        if principal.error is not None:
+            raise principal.error
+        user = principal.user
+        status_code = status.HTTP_401_UNAUTHORIZED
+        if user:
+            status_code = status.HTTP_403_FORBIDDEN
+            if active and not user.is_active:
+                status_code = status.HTTP_401_UNAUTHORIZED
+                user = None
+            elif (verified and not user.is_verified) or (superuser and not user.is_superuser):
+                user = None
+        if not user and not optional:
+            raise HTTPException(status_code=status_code)
+        return user, principal.token
 
 
 fastapi_users = FastAPIUsers[User, ULID](
     get_user_manager,
-    [redis_auth_backend, api_key_backend],
+    [bearer_auth_backend, api_key_backend],
 )
+fastapi_users.authenticator = PrincipalAuthenticator(
+    fastapi_users.authenticator.backends, get_user_manager
+)
+fastapi_users.current_user = fastapi_users.authenticator.current_user
+
 
-if settings.USE_DYNAMICALLY_ENABLED_AUTH_BACKENDS:
-    get_current_user = fastapi_users.current_user(
-        optional=True, get_enabled_backends=get_enabled_backends
-    )
-else:
-    get_current_user = fastapi_users.current_user(optional=True)
+async def get_current_user(
+    request: Request,
+    # only declared for the OpenAPI security schemes, the principal is already resolved
+    token: Annotated[str | None, Depends(redis_bearer_transport.scheme)],  # noqa: ARG001
+    api_key: Annotated[str | None, Depends(api_key_transport.scheme)],  # noqa: ARG001
+) -> User | None:
+    principal = await get_principal(request)
+    if principal.error is not None:
+        raise principal.error
+    return principal.user
 
 
 async def current_verified_active_user(  # noqa: RUF029
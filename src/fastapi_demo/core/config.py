@@ -13,9 +13,11 @@ from pydantic import (
     RedisDsn,
     SecretStr,
     computed_field,
+    model_validator,
 )
 from pydantic_core import MultiHostUrl
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing_extensions import Self
 
 
 def parse_cors(v: Any) -> list[str] | str:
@@ -35,6 +37,10 @@ class Settings(BaseSettings):
     # 60 minutes * 24 hours * 7 days = 7 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
     API_KEY_EXPIRE_MINUTES: int = 60
+    API_KEY_HASH_SCHEME: Literal["argon2", "hmac-sha256"] = "argon2"
+    # required by HMAC-SHA256 and shared by all the workers, changing it invalidates every API
+    # key hashed with HMAC-SHA256
+    API_KEY_HASH_PEPPER: str | None = None
 
     POSTGRES_SERVER: str
     POSTGRES_PORT: int = 5432
@@ -42,6 +48,13 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = ""
     POSTGRES_DB: str = ""
 
+    @model_validator(mode="after")
+    def _check_api_key_hash_pepper(self) -> Self:
+        # a pepper derived from the random SECRET_KEY default would differ between workers
+        if self.API_KEY_HASH_SCHEME == "hmac-sha256" and not self.API_KEY_HASH_PEPPER:
+            raise ValueError("API_KEY_HASH_PEPPER is required by the hmac-sha256 API key hashes")
+        return self
+
     @computed_field  # type: ignore[prop-decorator]
     @property
     def POSTGRES_URI(self) -> PostgresDsn:
@@ -54,6 +67,32 @@ class Settings(BaseSettings):
             path=self.POSTGRES_DB,
         )  # type: ignore[return-value]
 
+    # read replicas as `host` or `host:port`, with the credentials and database of the primary
+    POSTGRES_REPLICA_SERVERS: Annotated[list[str] | str, BeforeValidator(parse_cors)] = []
+    # replicas lagging further behind the primary are skipped
+    POSTGRES_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    POSTGRES_REPLICA_HEALTH_CHECK_INTERVAL_SECONDS: float = 5.0
+    # ids of the users and API keys changed within the lag bound, read from the primary
+    POSTGRES_REPLICA_RECENT_WRITES_MAX_SIZE: int = 10_000
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def POSTGRES_REPLICA_URIS(self) -> list[PostgresDsn]:
+        uris = []
+        for server in self.POSTGRES_REPLICA_SERVERS:
+            host, _, port = server.partition(":")
+            uris.append(
+                MultiHostUrl.build(
+                    scheme="postgresql+asyncpg",
+                    username=self.POSTGRES_USER,
+                    password=self.POSTGRES_PASSWORD,
+                    host=host,
+                    port=int(port) if port else self.POSTGRES_PORT,
+                    path=self.POSTGRES_DB,
+                )
+            )
+        return uris  # type: ignore[return-value]
+
     POOL_SIZE: int = 5
     MAX_OVERFLOW: int = 10
     POOL_RECYCLE: int = -1
@@ -63,10 +102,40 @@ class Settings(BaseSettings):
     REDIS_SERVER: str
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: str | None = None
+    # connection pools shared by every Redis client of a worker, one per database
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT_SECONDS: int = 5
+    REDIS_HEALTH_CHECK_INTERVAL_SECONDS: int = 30
+    REDIS_SOCKET_TIMEOUT_SECONDS: int | None = 5
+    REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS: int | None = 5
 
     REDIS_USERS_DB: int = 0
     REDIS_USERS_TOKEN_KEY_PREFIX: str = "fastapi_users_token:"  # noqa: S105
+    REDIS_USERS_TOKEN_INDEX_KEY_PREFIX: str = "fastapi_users_user_tokens:"  # noqa: S105
     REDIS_USERS_APIKEY_KEY_PREFIX: str = "fastapi_users_api_key:"
+    REDIS_USERS_INVALIDATION_CHANNEL: str = "fastapi_users_invalidation"
+    REDIS_USERS_REVOKED_TOKENS_KEY_PREFIX: str = "fastapi_users_revoked_tokens:"
+
+    # in-process caches of the authenticated users and bearer tokens (per worker)
+    USER_LOCAL_CACHE_MAX_SIZE: int = 10_000
+    USER_LOCAL_CACHE_TTL_SECONDS: int = 30
+    BEARER_TOKEN_LOCAL_CACHE_MAX_SIZE: int = 10_000
+    BEARER_TOKEN_LOCAL_CACHE_TTL_SECONDS: int = 30
+
+    # in-process cache in front of the Redis API keys cache (per worker)
+    API_KEY_LOCAL_CACHE_MAX_SIZE: int = 1024
+    API_KEY_LOCAL_CACHE_TTL_SECONDS: int = 30
+    # `last_used` is written in batches and lags by at most the sum of these two
+    API_KEY_LAST_USED_FLUSH_INTERVAL_SECONDS: int = 10
+    API_KEY_LAST_USED_MAX_STALENESS_SECONDS: int = 60
+    API_KEY_LAST_USED_MAX_PENDING: int = 1000
+    # rejection of API keys that can't be valid (see `APIKeyShield`)
+    API_KEY_NEGATIVE_CACHE_TTL_SECONDS: int = 60
+    API_KEY_NEGATIVE_CACHE_MAX_SIZE: int = 10_000
+    API_KEY_MAX_FAILED_VERIFICATIONS: int = 10
+    API_KEY_BLOOM_FILTER_CAPACITY: int = 100_000
+    API_KEY_BLOOM_FILTER_ERROR_RATE: float = 0.001
+    API_KEY_BLOOM_FILTER_REBUILD_INTERVAL_SECONDS: int = 600
 
     @computed_field  # type: ignore[prop-decorator]
     @property
@@ -83,18 +152,57 @@ class Settings(BaseSettings):
             str(self.FRONTEND_HOST)
         ]
 
+    # deadline of every request, applied to its Postgres, Redis and OpenFGA calls
+    # (`RequestDeadline` overrides it per route)
+    REQUEST_TIMEOUT_SECONDS: float | None = 30.0
+    REQUEST_TIMEOUT_SECONDS_SEARCH: float | None = 10.0
+    # cancel the read requests whose client disconnected (see `DisconnectMiddleware`)
+    CANCEL_ON_DISCONNECT_ENABLED: bool = True
+
     RATE_LIMITING_ENABLED: bool
     RATE_LIMITING_HEADERS_ENABLED: bool = False
     RATE_LIMITING_REDIS_DB: int = 1
     RATE_LIMITING_STRATEGY: Literal["sliding-window-counter", "fixed-window", "moving-window"] = (
         "fixed-window"
     )
+    # "leased": every worker takes the hits from Redis in leases and serves them locally,
+    # trading accuracy for Redis calls (see `LeasedRateLimiter` for the error bound)
+    RATE_LIMITING_MODE: Literal["exact", "leased"] = "exact"
+    RATE_LIMITING_LEASE_SIZE: int = 10
+    RATE_LIMITING_LEASE_TTL_SECONDS: float = 1.0
+    RATE_LIMITING_MAX_LEASES: int = 10_000
+    # what happens to the requests while Redis times out or fails (see `ResilientRateLimiter`)
+    RATE_LIMITING_ON_FAILURE: Literal["local", "open", "closed"] = "local"
+    RATE_LIMITING_TIMEOUT_SECONDS: float = 0.1
+    RATE_LIMITING_BREAKER_FAILURE_THRESHOLD: int = 5
+    RATE_LIMITING_BREAKER_RECOVERY_SECONDS: float = 5.0
+    RATE_LIMITING_FALLBACK_MAX_KEYS: int = 10_000
     RATE_LIMIT_VALUE_PER_SECOND_AUTH: int = 2
     RATE_LIMIT_VALUE_PER_SECOND_LOGGEDIN: int = 10
     RATE_LIMIT_VALUE_PER_SECOND_PUBLIC: int = 5
     RATE_LIMIT_VALUE_PER_MINUTE_AUTH: int = 60
     RATE_LIMIT_VALUE_PER_MINUTE_LOGGEDIN: int = 300
     RATE_LIMIT_VALUE_PER_MINUTE_PUBLIC: int = 100
+    # hits taken by the routes hashing a password or an API key, at most the burst limits
+    RATE_LIMIT_COST_PASSWORD_HASHING: int = 2
+    # in-flight requests per identity, waiting for up to the max wait over the limit
+    CONCURRENCY_LIMITING_ENABLED: bool = False
+    CONCURRENCY_LIMITING_MODE: Literal["local", "redis"] = "local"
+    CONCURRENCY_LIMIT_LOGGEDIN: int = 10
+    CONCURRENCY_LIMIT_PUBLIC: int = 4
+    CONCURRENCY_LIMITING_MAX_WAIT_SECONDS: float = 1.0
+    CONCURRENCY_LIMITING_SLOT_TTL_SECONDS: float = 60.0
+    CONCURRENCY_LIMITING_POLL_INTERVAL_SECONDS: float = 0.05
+    # requests over the adaptive concurrency limit of the process get a 503 (see `AdmissionController`)
+    ADMISSION_CONTROL_ENABLED: bool = False
+    ADMISSION_CONTROL_INITIAL_LIMIT: int = 100
+    ADMISSION_CONTROL_MIN_LIMIT: int = 10
+    ADMISSION_CONTROL_MAX_LIMIT: int = 1000
+    ADMISSION_CONTROL_LATENCY_TARGET_SECONDS: float = 0.5
+    ADMISSION_CONTROL_SLOW_LATENCY_TARGET_SECONDS: float = 5.0
+    ADMISSION_CONTROL_BACKOFF_RATIO: float = 0.9
+    ADMISSION_CONTROL_HIGH_PRIORITY_HEADROOM: float = 0.25
+    ADMISSION_CONTROL_RETRY_AFTER_SECONDS: int = 1
     # RATE_LIMITING_USERS_CACHE_REDIS_DB: int = 3
     # RATE_LIMITING_USERS_CACHE_TTL: int = 3600
 
@@ -131,6 +239,14 @@ class Settings(BaseSettings):
     USER_PASSWORD_MIN_LENGTH: int = 8
     USER_PASSWORD_MAX_LENGTH: int = 40
     USE_DYNAMICALLY_ENABLED_AUTH_BACKENDS: bool = False
+    # "redis": opaque tokens looked up in Redis, "jwt": signed tokens verified locally
+    BEARER_AUTH_BACKEND: Literal["redis", "jwt"] = "redis"
+    JWT_ALGORITHM: str = "HS256"
+
+    # pool running the password and API keys hashing off the event loop
+    HASHING_EXECUTOR: Literal["thread", "process"] = "thread"
+    HASHING_MAX_WORKERS: int | None = None
+    HASHING_MAX_CONCURRENCY: int = 16
 
     GOOGLE_CLIENT_ID: str
     GOOGLE_CLIENT_SECRET: str
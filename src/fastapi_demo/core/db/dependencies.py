@@ -1,19 +1,87 @@
 from collections.abc import AsyncGenerator
-from typing import Annotated
+from typing import Annotated, Any
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi_users_db_sqlmodel import SQLModelUserDatabaseAsync
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ulid import ULID
 
-from fastapi_demo.core.db.engine import SQLAlchemyAsyncSessionMaker
+from fastapi_demo.core.db.engine import AsyncSessionMaker
 from fastapi_demo.core.models import metadata  # noqa: F401 # NOTE: this is used for migrations
 from fastapi_demo.core.models.users import OAuthAccount, User
 
 
+class UserDatabase(SQLModelUserDatabaseAsync[User, ULID]):
+    """
+    The users' relationships are only loaded by the OAuth flows of `fastapi_users`, which
+    read and extend the OAuth accounts of a user.
+    - Queries go through `session.exec`, the session being the SQLModel one shared with the
+      services.
+    - Users aren't refreshed after they are written: the INSERT and UPDATE statements return
+      the columns set by the database.
+    """
+
+    session: AsyncSession
+
+    async def get_by_email(self, email: str) -> User | None:
+        statement = select(User).where(func.lower(User.email) == func.lower(email))
+        return (await self.session.exec(statement)).first()
+
+    async def get_by_oauth_account(self, oauth: str, account_id: str) -> User | None:
+        statement = (
+            select(OAuthAccount)
+            .where(OAuthAccount.oauth_name == oauth)
+            .where(OAuthAccount.account_id == account_id)
+            .options(selectinload(OAuthAccount.user).selectinload(User.oauth_accounts))  # type: ignore[arg-type]
+        )
+        oauth_account = (await self.session.exec(statement)).first()
+        return oauth_account.user if oauth_account else None
+
+    async def create(self, create_dict: dict[str, Any]) -> User:
+        user = User(**create_dict)
+        self.session.add(user)
+        await self.session.commit()
+        return user
+
+    async def update(self, user: User, update_dict: dict[str, Any]) -> User:
+        for key, value in update_dict.items():
+            setattr(user, key, value)
+        self.session.add(user)
+        await self.session.commit()
+        return user
+
+    async def add_oauth_account(self, user: User, create_dict: dict[str, Any]) -> User:
+        await self.session.refresh(user, attribute_names=["oauth_accounts"])
+        return await super().add_oauth_account(user, create_dict)
+
+
 async def get_async_session() -> AsyncGenerator[AsyncSession]:
-    async with SQLAlchemyAsyncSessionMaker() as session:
+    """A session of its own, for the code running outside of the requests"""
+    async with AsyncSessionMaker() as session:
+        yield session
+
+
+async def get_request_session(request: Request) -> AsyncGenerator[AsyncSession]:
+    """
+    The session of a request, shared by `AuthenticationMiddleware`, `fastapi_users` and the
+    services.
+    - FastAPI solves a dependency once per request, so a route using both holds a single
+      connection rather than one per session.
+    - The connection is only checked out from the pool by the first query, a route that never
+      queries the database holds none.
+    - The session the middleware opened to resolve the principal is reused, the middleware
+      closes it once the response is sent.
+    """
+    session: AsyncSession | None = getattr(request.state, "session", None)
+    if session is not None:
+        yield session
+        return
+    async with AsyncSessionMaker() as session:
         yield session
 
 
-async def get_user_db(session: Annotated[AsyncSession, Depends(get_async_session)]):  # type: ignore[no-untyped-def] # noqa: RUF029
-    yield SQLModelUserDatabaseAsync(session, User, OAuthAccount)
+async def get_user_db(session: Annotated[AsyncSession, Depends(get_request_session)]):  # type: ignore[no-untyped-def] # noqa: RUF029
+    yield UserDatabase(session, User, OAuthAccount)
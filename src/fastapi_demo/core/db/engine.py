@@ -1,23 +1,58 @@
-from sqlalchemy.ext.asyncio import AsyncSession as SQLAlchemyAsyncSession
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import Connection, event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, SessionTransaction
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from fastapi_demo.core.config import settings
+from fastapi_demo.core.db.replicas import ReplicaSet, RoutingSession
+from fastapi_demo.core.db.types import register_ulid_codec
 from fastapi_demo.core.models import metadata  # noqa: F401 # NOTE: this is used for migrations
+from fastapi_demo.core.utils.deadline import get_remaining_seconds
 
-engine = create_async_engine(
-    str(settings.POSTGRES_URI),
-    future=True,
-    pool_size=settings.POOL_SIZE,
-    max_overflow=settings.MAX_OVERFLOW,
-    pool_recycle=settings.POOL_RECYCLE,
-    pool_pre_ping=settings.POOL_PRE_PING,
-    pool_timeout=settings.POOL_TIMEOUT,
+ENGINE_OPTIONS = {
+    "future": True,
+    "pool_size": settings.POOL_SIZE,
+    "max_overflow": settings.MAX_OVERFLOW,
+    "pool_recycle": settings.POOL_RECYCLE,
+    "pool_pre_ping": settings.POOL_PRE_PING,
+    "pool_timeout": settings.POOL_TIMEOUT,
+}
+
+
+def create_engine(uri: str) -> AsyncEngine:
+    db_engine = create_async_engine(uri, **ENGINE_OPTIONS)
+    register_ulid_codec(db_engine)
+    return db_engine
+
+
+engine = create_engine(str(settings.POSTGRES_URI))
+replica_set = ReplicaSet(
+    [create_engine(str(uri)) for uri in settings.POSTGRES_REPLICA_URIS],
+    max_lag_seconds=settings.POSTGRES_REPLICA_MAX_LAG_SECONDS,
+    health_check_interval_seconds=settings.POSTGRES_REPLICA_HEALTH_CHECK_INTERVAL_SECONDS,
 )
-SQLAlchemyAsyncSessionMaker = async_sessionmaker(
-    engine, expire_on_commit=False, class_=SQLAlchemyAsyncSession
+
+
+@event.listens_for(RoutingSession, "after_begin")
+def set_statement_timeout(
+    session: Session,  # noqa: ARG001
+    transaction: SessionTransaction,  # noqa: ARG001
+    connection: Connection,
+) -> None:
+    # queries of a request can't outlive its deadline; only the sessions of the app, not the
+    # ones of the scripts or migrations
+    remaining = get_remaining_seconds()
+    if remaining is not None:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, int(remaining * 1000))}")
+
+
+AsyncSessionMaker = async_sessionmaker(
+    engine,
+    expire_on_commit=False,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    replica_set=replica_set,
 )
-AsyncSessionMaker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
 # # NOTE: This won't be used in the case of using **alembic**
@@ -0,0 +1,238 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+from collections.abc import AsyncGenerator, Generator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import Select, event, text
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from fastapi_demo.core.utils.cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# keys of `Session.info`
+REPLICA_READS = "replica_reads"
+REPLICA = "replica"
+WROTE = "wrote"
+
+# A replica that replayed all the WAL it received isn't lagging, even if the primary is idle,
+# as long as it is still receiving: NULL when its WAL receiver isn't streaming. The receiver
+# status is only visible with the privileges of `pg_read_all_stats`, its process otherwise.
+REPLICATION_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT FROM pg_stat_wal_receiver WHERE status IS NULL OR status = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+
+
+@dataclass(slots=True)
+class Replica:
+    engine: AsyncEngine
+    healthy: bool = False
+    lag_seconds: float | None = None
+    failures: int = 0
+
+    async def replication_lag(self) -> float:
+        async with self.engine.connect() as connection:
+            lag = await connection.scalar(REPLICATION_LAG_QUERY)
+        if lag is None:
+            raise RuntimeError("The WAL receiver isn't streaming")
+        return float(lag)
+
+    def on_error(self, context: ExceptionContext) -> None:
+        if context.is_disconnect and self.healthy:
+            logger.warning("Replica %s disconnected", self.engine.url.host)
+            self.healthy = False
+
+
+class ReplicaSet:
+    """
+    Read replicas of the primary database, used in turn.
+    - A replica is only used while its replication lag, checked every
+      `health_check_interval_seconds`, is below `max_lag_seconds`.
+    - A replica failing the check or dropping a connection is skipped until it passes the
+      check again. Without any healthy replica, reads go to the primary.
+    """
+
+    def __init__(
+        self,
+        engines: list[AsyncEngine],
+        *,
+        max_lag_seconds: float,
+        health_check_interval_seconds: float,
+    ):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag_seconds = max_lag_seconds
+        self.health_check_interval_seconds = health_check_interval_seconds
+        self.routed_reads = 0
+        self._cycle = itertools.cycle(self.replicas)
+        for replica in self.replicas:
+            event.listen(replica.engine.sync_engine, "handle_error", replica.on_error)
+
+    def choose(self) -> Replica | None:
+        for _ in range(len(self.replicas)):
+            replica = next(self._cycle)
+            if replica.healthy:
+                return replica
+        return None
+
+    @property
+    def staleness_bound_seconds(self) -> float:
+        # a replica may exceed the lag bound until its next check
+        return self.max_lag_seconds + self.health_check_interval_seconds
+
+    async def check(self, replica: Replica) -> None:
+        try:
+            lag = await asyncio.wait_for(
+                replica.replication_lag(), timeout=self.health_check_interval_seconds
+            )
+        except Exception as exc:
+            replica.failures += 1
+            replica.lag_seconds = None
+            if replica.healthy:
+                logger.warning("Replica %s failed its check: %r", replica.engine.url.host, exc)
+            replica.healthy = False
+            return
+        replica.lag_seconds = lag
+        healthy = lag <= self.max_lag_seconds
+        if healthy != replica.healthy:
+            logger.info(
+                "Replica %s is %s (lag: %.1fs)",
+                replica.engine.url.host,
+                "healthy" if healthy else "lagging",
+                lag,
+            )
+        replica.healthy = healthy
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval_seconds)
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator[None]:
+        if not self.replicas:
+            yield
+            return
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+        task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            for replica in self.replicas:
+                await replica.engine.dispose()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "routed_reads": self.routed_reads,
+            "replicas": {
+                str(replica.engine.url.host): {
+                    "healthy": replica.healthy,
+                    "lag_seconds": replica.lag_seconds,
+                    "failures": replica.failures,
+                }
+                for replica in self.replicas
+            },
+        }
+
+
+class RecentWrites:
+    """
+    Ids written within `ttl_seconds`, the time a replica may take to replicate the write.
+    - Lookups whose result is cached read these ids from the primary, so that a lagging
+      replica can't put the previous version back in the cache.
+    - Fed by the invalidation bus: when invalidations may have been missed, every id counts
+      as recently written for `ttl_seconds`.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._ids: LocalTTLCache[str, bool] = LocalTTLCache(maxsize, ttl_seconds)
+        self._all_until = 0.0
+
+    def add(self, *ids: str) -> None:
+        for id_ in ids:
+            self._ids.set(id_, True)
+
+    def reset(self) -> None:
+        self._all_until = time.monotonic() + self.ttl_seconds
+
+    def __contains__(self, id_: object) -> bool:
+        return time.monotonic() < self._all_until or id_ in self._ids
+
+
+class RoutingSession(Session):
+    """
+    Session sending the reads made within `replica_reads(session)` to a healthy replica.
+    - Only SELECT statements without FOR UPDATE are routed; flushes and any other statement
+      go to the primary.
+    - Once the session has written, all its reads go to the primary, so that a request
+      reads its own writes.
+    - The session keeps the replica it first read from while it is healthy, rather than
+      holding a connection to several of them.
+    """
+
+    def __init__(self, *args: Any, replica_set: ReplicaSet | None = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.replica_set = replica_set
+
+    def get_bind(self, mapper: Any = None, *, clause: Any = None, **kwargs: Any) -> Any:
+        is_read = isinstance(clause, Select) and clause._for_update_arg is None
+        if clause is not None and not is_read:
+            self.info[WROTE] = True
+        elif is_read and self.replica_set is not None and self.reads_from_replica():
+            replica: Replica | None = self.info.get(REPLICA)
+            if replica is None or not replica.healthy:
+                replica = self.info[REPLICA] = self.replica_set.choose()
+            if replica is not None:
+                self.replica_set.routed_reads += 1
+                return replica.engine.sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    def reads_from_replica(self) -> bool:
+        return (
+            bool(self.replica_set and self.replica_set.replicas)
+            and self.info.get(REPLICA_READS, False)
+            and not self.info.get(WROTE, False)
+        )
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def stick_to_primary(session: Session, flush_context: Any) -> None:  # noqa: ARG001
+    session.info[WROTE] = True
+
+
+@contextlib.contextmanager
+def replica_reads(session: AsyncSession, enabled: bool = True) -> Generator[None]:
+    """Send the reads of the block to a replica, or to the primary when not `enabled`"""
+    info = session.sync_session.info
+    previous = info.get(REPLICA_READS, False)
+    info[REPLICA_READS] = enabled
+    try:
+        yield
+    finally:
+        info[REPLICA_READS] = previous
+
+
+def reads_from_replica(session: AsyncSession) -> bool:
+    """Whether a read of the session may go to a replica, i.e. may miss the latest writes"""
+    sync_session = session.sync_session
+    return isinstance(sync_session, RoutingSession) and sync_session.reads_from_replica()
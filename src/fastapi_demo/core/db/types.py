@@ -1,12 +1,63 @@
+import os
+import threading
+import time
+from typing import cast
+
+import asyncpg
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.types import UserDefinedType
 from ulid import ULID
 
+ULID_TYPE_QUERY = """
+SELECT n.nspname, t.typsend::oid <> 0 AND t.typreceive::oid <> 0
+FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+WHERE t.typname = 'ulid'
+"""
+SAMPLE_ULID = ULID.from_str("01ARZ3NDEKTSV4RRFFQ69G5FAV")
+RANDOM_BITS = 80
+RANDOM_MASK = (1 << RANDOM_BITS) - 1
+
+
+class MonotonicULIDGenerator:
+    """
+    ULIDs strictly increasing within the process, as `gen_monotonic_ulid()` generates them
+    within a Postgres backend.
+    - A ULID of the same millisecond as the previous one (or of an earlier one, if the clock
+      went backwards) is the previous one plus one, instead of a new random one.
+    - When the random part of the previous one is all ones, the next one is of the following
+      millisecond, with a new random part, rather than one ahead of the clock by accident.
+    - Ids of different workers are only ordered by their millisecond.
+    """
+
+    def __init__(self) -> None:
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> ULID:
+        random = int.from_bytes(os.urandom(10), "big")
+        value = (time.time_ns() // 1_000_000) << RANDOM_BITS | random
+        with self._lock:
+            last_millis = self._last >> RANDOM_BITS
+            if value >> RANDOM_BITS <= last_millis:
+                if self._last & RANDOM_MASK == RANDOM_MASK:
+                    value = (last_millis + 1) << RANDOM_BITS | random
+                else:
+                    value = self._last + 1
+            self._last = value
+        return cast(ULID, ULID.from_int(value))
+
+
+generate_monotonic_ulid = MonotonicULIDGenerator()
+
 
 class PGULID(UserDefinedType):
     """
     Map the Postgres 'ulid' type to python-ulid's ULID objects.
     - On bind (python -> db) we accept ulid.ULID, str or bytes.
     - On result (db -> python) we return ulid.ULID for convenience.
+    - Engines with `register_ulid_codec` get ULID objects from asyncpg itself, the values
+      don't go through the processors below.
     """
 
     cache_ok = True
@@ -15,7 +66,10 @@ class PGULID(UserDefinedType):
         # the literal type name in Postgres
         return "ulid"
 
-    def bind_processor(self, dialect):  # type: ignore[no-untyped-def] # noqa: ARG002, PLR6301
+    def bind_processor(self, dialect):  # type: ignore[no-untyped-def] # noqa: PLR6301
+        if getattr(dialect, "ulid_codec", False):
+            return None
+
         def process(value):  # type: ignore[no-untyped-def]
             if value is None:
                 return None
@@ -28,6 +82,9 @@ class PGULID(UserDefinedType):
         return process
 
     def result_processor(self, dialect, coltype):  # type: ignore[no-untyped-def] # noqa: ARG002, PLR6301
+        if getattr(dialect, "ulid_codec", False):
+            return None
+
         def process(value):  # type: ignore[no-untyped-def]
             if value is None:
                 return None
@@ -39,3 +96,64 @@ class PGULID(UserDefinedType):
                 return value
 
         return process
+
+
+def to_ulid(value: ULID | str | bytes) -> ULID:
+    if isinstance(value, ULID):
+        return value
+    if isinstance(value, str):
+        return cast(ULID, ULID.from_str(value))
+    return cast(ULID, ULID.from_bytes(value))
+
+
+async def set_ulid_codec(connection: asyncpg.Connection) -> bool:
+    """
+    Have asyncpg exchange the `ulid` values as ULID objects, return whether it does.
+    - In the 16 bytes binary format when the extension has binary send and receive
+      functions that round-trip a known ULID, in the text format otherwise.
+    - Nothing to do until the extension is installed: no column can be of the type yet.
+    """
+    row = await connection.fetchrow(ULID_TYPE_QUERY)
+    if row is None:
+        return False
+    schema, binary = row
+    if binary:
+        await connection.set_type_codec(
+            "ulid",
+            schema=schema,
+            encoder=lambda value: to_ulid(value).bytes,
+            decoder=ULID.from_bytes,
+            format="binary",
+        )
+        try:
+            decoded = await connection.fetchval(f"SELECT '{SAMPLE_ULID}'::{schema}.ulid")
+        except (asyncpg.PostgresError, ValueError):
+            decoded = None
+        if decoded == SAMPLE_ULID:
+            return True
+    await connection.set_type_codec(
+        "ulid",
+        schema=schema,
+        encoder=lambda value: str(to_ulid(value)),
+        decoder=ULID.from_str,
+        format="text",
+    )
+    return True
+
+
+def register_ulid_codec(engine: AsyncEngine) -> None:
+    """
+    Decode the `ulid` values of an asyncpg engine in the driver, see `set_ulid_codec`.
+    - A connection opened before the extension was installed gets the codec when it is next
+      checked out, before any `ulid` value goes through it.
+    """
+    engine.dialect.ulid_codec = True  # type: ignore[attr-defined]
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record) -> None:  # type: ignore[no-untyped-def]
+        connection_record.info["ulid_codec"] = dbapi_connection.run_async(set_ulid_codec)
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:  # type: ignore[no-untyped-def] # noqa: ARG001
+        if not connection_record.info.get("ulid_codec"):
+            connection_record.info["ulid_codec"] = dbapi_connection.run_async(set_ulid_codec)
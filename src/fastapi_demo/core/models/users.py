@@ -17,7 +17,7 @@ class OAuthAccount(ULIDPrimaryKeyMixin, SQLModelBaseOAuthAccount, table=True):
     )
 
     user: Optional["User"] = Relationship(
-        back_populates="oauth_accounts", sa_relationship_kwargs={"lazy": "joined"}
+        back_populates="oauth_accounts", sa_relationship_kwargs={"lazy": "raise"}
     )
 
 
@@ -36,12 +36,14 @@ class APIKey(ULIDPrimaryKeyMixin, TimestampMixin, SQLModel, table=True):
     key_hash: str = Field(nullable=False)
     key_preview: str = Field(nullable=False)
     name: str = Field(max_length=255, nullable=False)
-    owner_id: ULID = Field(foreign_key="user.id", nullable=False, index=True, sa_type=PGULID())  # type: ignore[call-overload]
+    owner_id: ULID = Field(  # type: ignore[call-overload]
+        foreign_key="user.id", ondelete="CASCADE", nullable=False, index=True, sa_type=PGULID()
+    )
     last_used: datetime | None = Field(default=None, sa_type=DateTime(timezone=True), nullable=True)  # type: ignore[call-overload]
     revoked: bool = Field(default=False)
 
     user: Optional["User"] = Relationship(
-        back_populates="api_keys", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="api_keys", sa_relationship_kwargs={"lazy": "raise"}
     )
 
 
@@ -69,11 +71,13 @@ class User(ULIDPrimaryKeyMixin, TimestampMixin, SQLModelBaseUserDB, table=True):
     first_name: str | None = Field(default=None, max_length=255)
     last_name: str | None = Field(default=None, max_length=255)
 
+    # relationships are never loaded implicitly: a query loads them with `selectinload`
+    # when it needs them, and they are deleted by the database with their user
     oauth_accounts: list[OAuthAccount] = Relationship(
         back_populates="user",
         passive_deletes=True,
         sa_relationship_kwargs={
-            "lazy": "joined",
+            "lazy": "raise",
             "cascade": "all, delete-orphan",
             "single_parent": True,
         },
@@ -82,7 +86,7 @@ class User(ULIDPrimaryKeyMixin, TimestampMixin, SQLModelBaseUserDB, table=True):
         back_populates="user",
         passive_deletes=True,
         sa_relationship_kwargs={
-            "lazy": "selectin",
+            "lazy": "raise",
             "cascade": "all, delete-orphan",
             "single_parent": True,
         },
@@ -8,7 +8,7 @@ from sqlmodel import DateTime, SQLModel, func, text
 from sqlmodel import Field as SQLModelField
 from ulid import ULID
 
-from fastapi_demo.core.db.types import PGULID
+from fastapi_demo.core.db.types import PGULID, generate_monotonic_ulid
 
 T = TypeVar("T")
 
@@ -43,7 +43,10 @@ class PaginationAndSearchParams(PaginationParams, SearchParams):
 
 
 class ULIDPrimaryKeyMixin(SQLModel):
+    # generated by the application, so that an insert doesn't need to return the id; the
+    # server default is kept for the rows inserted with SQL
     id: ULID = SQLModelField(  # type: ignore[call-overload]
+        default_factory=generate_monotonic_ulid,
         primary_key=True,
         nullable=False,
         sa_type=PGULID(),
@@ -52,6 +55,10 @@ class ULIDPrimaryKeyMixin(SQLModel):
 
 
 class TimestampMixin(SQLModel):
+    # the timestamps set by the database are returned by the INSERT and UPDATE statements
+    # (RETURNING), rather than loaded by another query
+    __mapper_args__ = {"eager_defaults": True}
+
     created_at: datetime = SQLModelField(  # type: ignore[call-overload]
         sa_type=DateTime(timezone=True),
         sa_column_kwargs={"server_default": func.now()},
@@ -1,43 +1,53 @@
+import asyncio
+import logging
 import secrets
 from datetime import datetime, timezone
 from typing import Any
 
 import redis.asyncio as aioredis
-from asyncpg import UniqueViolationError
+from asyncpg import ForeignKeyViolationError, UniqueViolationError
 from fastapi_pagination.ext.sqlmodel import apaginate
-from pwdlib.hashers.argon2 import Argon2Hasher
+from redis.exceptions import RedisError
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import col, desc, select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 from ulid import ULID
 
+from fastapi_demo.core.auth.hashing import api_key_hasher
 from fastapi_demo.core.config import Settings
+from fastapi_demo.core.db.replicas import replica_reads
 from fastapi_demo.core.exceptions import APIKeyNotFoundOrRevokedError, UserNotFoundError
 from fastapi_demo.core.models.users import APIKey, User
 from fastapi_demo.core.schemas.api_keys import APIKeyCreateRequest, APIKeyUpdate
+from fastapi_demo.core.utils.pubsub import InvalidationBus
+
+logger = logging.getLogger(__name__)
+
+API_KEY_CACHE_NAMESPACE = "api_key"
+API_KEY_CREATED_NAMESPACE = "api_key_created"
 
 
 class APIKeyService:
-    def __init__(self, session: AsyncSession, settings: Settings):
+    def __init__(
+        self,
+        session: AsyncSession,
+        settings: Settings,
+        redis_users_client: aioredis.Redis,
+        invalidation_bus: InvalidationBus | None = None,
+    ):
         self.session = session
-        self.hasher = Argon2Hasher()
-        self.redis = aioredis.from_url(
-            str(settings.REDIS_URI), decode_responses=True, db=settings.REDIS_USERS_DB
-        )
+        self.redis = redis_users_client
         self.key_prefix = settings.REDIS_USERS_APIKEY_KEY_PREFIX
+        self.invalidation_bus = invalidation_bus
 
     async def create_api_key(
         self, api_key_create: APIKeyCreateRequest, owner_id: ULID, *, verify_user: bool = True
     ) -> dict[str, Any]:
-        if verify_user:
-            user = await self.session.get(User, owner_id)
-            if not user:
-                raise UserNotFoundError(owner_id)
-
         while True:
-            key_id = f"fastapi-demo-{secrets.token_urlsafe(16)}"
+            # the ULID tells `APIKeyShield` how recent the key is
+            key_id = f"fastapi-demo-{ULID()}"
             key_secret = secrets.token_urlsafe(32)
-            hashed_key = self.hasher.hash(key_secret)
+            hashed_key = await api_key_hasher.hash(key_secret)
             key_preview = f"fastapi-demo-...{key_secret[-4:]}"
             name = api_key_create.name
             db_key = APIKey(
@@ -50,17 +60,21 @@ class APIKeyService:
 
             self.session.add(db_key)
             try:
+                # the id is generated here and the timestamps are returned by the INSERT
                 await self.session.commit()
-                await self.session.refresh(db_key)
                 break
             except IntegrityError as exc:
-                # print(str(exc))
                 await self.session.rollback()
-                is_unique = isinstance(exc.orig, UniqueViolationError)
-                if is_unique:
+                sqlstate = getattr(exc.orig, "sqlstate", None)
+                if sqlstate == UniqueViolationError.sqlstate:
                     # key_id collision
                     continue
+                if verify_user and sqlstate == ForeignKeyViolationError.sqlstate:
+                    # the owner is checked by the foreign key rather than by another query
+                    raise UserNotFoundError(owner_id) from None
                 raise
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.publish(API_KEY_CREATED_NAMESPACE, key_id)
         return {
             "api_key": f"{key_id}.{key_secret}",
             "key_id": key_id,
@@ -77,16 +91,15 @@ class APIKeyService:
         verify_user: bool = True,
     ):
         if verify_user:
-            user = await self.session.get(User, owner_id)
-            if not user:
-                raise UserNotFoundError(owner_id)
+            await self._ensure_user_exists(owner_id)
 
         statement = select(APIKey).where(APIKey.owner_id == owner_id).where(APIKey.revoked == False)  # noqa: E712
 
         if search is not None:
             pattern = f"%{search}%"
             statement = statement.where(col(APIKey.name).ilike(pattern))
-        page = await apaginate(self.session, statement.order_by(desc(APIKey.id)))  # type: ignore[arg-type]
+        with replica_reads(self.session):
+            page = await apaginate(self.session, statement.order_by(desc(APIKey.id)))  # type: ignore[arg-type]
         return page
 
     async def update_api_key(
@@ -100,9 +113,7 @@ class APIKeyService:
         statement = select(APIKey).where(APIKey.key_id == api_key_id).where(APIKey.revoked == False)  # noqa: E712
         if user_id:
             if verify_user:
-                owner = await self.session.get(User, user_id)
-                if not owner:
-                    raise UserNotFoundError(user_id=user_id)
+                await self._ensure_user_exists(user_id)
             statement = statement.where(APIKey.owner_id == user_id)
 
         query_result = await self.session.exec(statement)
@@ -116,7 +127,7 @@ class APIKeyService:
         self.session.add(db_key)
         await self.session.commit()
         # await self.session.refresh(db_key)
-        await self.redis.delete(f"{self.key_prefix}{api_key_id}")
+        await self._invalidate_cached_api_keys(api_key_id)
 
         return db_key
 
@@ -126,9 +137,7 @@ class APIKeyService:
         statement = select(APIKey).where(APIKey.key_id == api_key_id).where(APIKey.revoked == False)  # noqa: E712
         if user_id:
             if verify_user:
-                user = await self.session.get(User, user_id)
-                if not user:
-                    raise UserNotFoundError(user_id)
+                await self._ensure_user_exists(user_id)
             statement = statement.where(APIKey.owner_id == user_id)
 
         query_result = await self.session.exec(statement)
@@ -139,13 +148,11 @@ class APIKeyService:
         key_entry.revoked = True
         self.session.add(key_entry)
         await self.session.commit()
-        await self.redis.delete(f"{self.key_prefix}{api_key_id}")
+        await self._invalidate_cached_api_keys(api_key_id)
 
     async def revoke_user_all_api_keys(self, owner_id: ULID, *, verify_user: bool = True) -> int:
         if verify_user:
-            user = await self.session.get(User, owner_id)
-            if not user:
-                raise UserNotFoundError(owner_id)
+            await self._ensure_user_exists(owner_id)
 
         update_statement = (
             update(APIKey)
@@ -164,7 +171,24 @@ class APIKeyService:
         update_result = await self.session.exec(update_statement)  # type: ignore[call-overload]
         await self.session.commit()
 
-        if api_key_ids:
-            redis_keys = [f"{self.key_prefix}{key_id}" for key_id in api_key_ids]
-            await self.redis.unlink(*redis_keys)
+        await self._invalidate_cached_api_keys(*api_key_ids)
         return update_result.rowcount or 0
+
+    async def _ensure_user_exists(self, user_id: ULID) -> None:
+        # the id alone, the user isn't needed
+        result = await self.session.exec(select(col(User.id)).where(col(User.id) == user_id))
+        if result.first() is None:
+            raise UserNotFoundError(user_id)
+
+    async def _invalidate_cached_api_keys(self, *api_key_ids: str) -> None:
+        if not api_key_ids:
+            return
+        redis_keys = [f"{self.key_prefix}{key_id}" for key_id in api_key_ids]
+        try:
+            await self.redis.unlink(*redis_keys)
+        except (RedisError, asyncio.TimeoutError) as exc:
+            # the change is committed: the cached keys expire after `API_KEY_EXPIRE_MINUTES`
+            logger.warning("Failed to evict the cached API keys: %r", exc)
+        # evict the in-process caches of every worker
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.publish(API_KEY_CACHE_NAMESPACE, *api_key_ids)
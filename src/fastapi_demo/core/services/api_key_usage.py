@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import DateTime, String, column, or_, values
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import col, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from fastapi_demo.core.models.users import APIKey
+from fastapi_demo.core.utils.cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class APIKeyUsageRecorder:
+    """
+    Buffer the `last_used` timestamps of API keys in memory and write them to the `apikey`
+    table in periodic bulk updates, keeping the authentication path read-only.
+    - A key recorded less than `max_staleness_seconds` ago is not recorded again, so a hot
+      key costs at most one row update per staleness window.
+    - Pending timestamps are flushed every `flush_interval_seconds`, as soon as
+      `max_pending` keys are buffered, and on shutdown.
+    - The persisted `last_used` therefore lags by at most
+      `max_staleness_seconds + flush_interval_seconds`.
+    - A failed flush keeps its timestamps for the next one, up to `max_pending`: beyond, the
+      oldest are dropped.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        *,
+        flush_interval_seconds: float,
+        max_staleness_seconds: float,
+        max_pending: int,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self._pending: dict[str, datetime] = {}
+        self._recently_recorded: LocalTTLCache[str, bool] = LocalTTLCache(
+            maxsize=10 * max_pending, ttl_seconds=max_staleness_seconds
+        )
+        self._flush_requested = asyncio.Event()
+
+    def record(self, key_id: str) -> None:
+        if key_id in self._recently_recorded:
+            return
+        self._recently_recorded.set(key_id, True)
+        self._pending[key_id] = datetime.now(timezone.utc)
+        if len(self._pending) >= self.max_pending:
+            self._flush_requested.set()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+
+        last_used_values = values(
+            column("key_id", String),
+            column("last_used", DateTime(timezone=True)),
+            name="last_used_values",
+        ).data(list(pending.items()))
+        statement = (
+            update(APIKey)
+            .where(col(APIKey.key_id) == last_used_values.c.key_id)
+            .where(
+                or_(
+                    col(APIKey.last_used).is_(None),
+                    col(APIKey.last_used) < last_used_values.c.last_used,
+                )
+            )
+            .values(last_used=last_used_values.c.last_used)
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            async with self.session_factory() as session:
+                await session.exec(statement)  # type: ignore[call-overload]
+                await session.commit()
+        except Exception:
+            # keep them for the next flush, unless the key was used again in the meantime
+            self._pending = {**pending, **self._pending}
+            self._drop_oldest()
+            raise
+        return len(pending)
+
+    def _drop_oldest(self) -> None:
+        # while the database is down, only the `max_pending` latest timestamps are kept
+        dropped = len(self._pending) - self.max_pending
+        if dropped <= 0:
+            return
+        by_age = sorted(self._pending.items(), key=lambda item: item[1])
+        self._pending = dict(by_age[dropped:])
+        logger.warning(
+            "Dropped the 'last_used' timestamps of %d API keys, used from %s to %s: %s",
+            dropped,
+            by_age[0][1].isoformat(),
+            by_age[dropped - 1][1].isoformat(),
+            ", ".join(key_id for key_id, _ in by_age[:dropped]),
+        )
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), timeout=self.flush_interval_seconds
+                )
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush the API keys 'last_used' timestamps")
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator[None]:
+        task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush the API keys 'last_used' timestamps")
@@ -1,39 +1,87 @@
+import math
+from datetime import datetime, timezone
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from redis.asyncio.client import Redis
     from ulid import ULID
 
+    from fastapi_demo.core.auth.backends import SignedTokenStrategy
+    from fastapi_demo.core.utils.pubsub import InvalidationBus
+
+BEARER_TOKEN_CACHE_NAMESPACE = "bearer_token"  # noqa: S105
+
+# Delete every token of a user along with the index, atomically, and return the tokens.
+# The tokens keys are only known from the index, so they aren't declared in KEYS: the script
+# needs all the keys on a single node, Redis Cluster isn't supported.
+# Tokens issued before the index are indexed by `scripts/backfill_user_tokens_index.py`.
+# KEYS[1]: user tokens index, ARGV[1]: tokens key prefix
+REVOKE_ALL_USER_TOKENS_SCRIPT = """
+local tokens = redis.call('ZRANGE', KEYS[1], 0, -1)
+for _, token in ipairs(tokens) do
+    redis.call('UNLINK', ARGV[1] .. token)
+end
+redis.call('UNLINK', KEYS[1])
+return tokens
+"""
+
 
 class TokenService:
-    def __init__(self, redis_users_client: "Redis", redis_users_key_prefix: str):
+    def __init__(
+        self,
+        redis_users_client: "Redis",
+        redis_users_key_prefix: str,
+        redis_users_index_key_prefix: str,
+        invalidation_bus: "InvalidationBus | None" = None,
+        signed_token_strategy: "SignedTokenStrategy | None" = None,
+    ):
         self.redis = redis_users_client
         self.redis_users_key_prefix = redis_users_key_prefix
+        self.redis_users_index_key_prefix = redis_users_index_key_prefix
+        self.invalidation_bus = invalidation_bus
+        self.signed_token_strategy = signed_token_strategy
+        self.revoke_all_user_tokens = self.redis.register_script(REVOKE_ALL_USER_TOKENS_SCRIPT)
 
     async def revoke(self, token: str) -> None:
-        await self.redis.delete(f"{self.redis_users_key_prefix}{token}")
+        if self.signed_token_strategy is not None and token.count(".") == 2:  # noqa: PLR2004
+            await self.signed_token_strategy.revoke(token)
+            return
+        user_id = await self.redis.getdel(f"{self.redis_users_key_prefix}{token}")
+        if user_id is not None:
+            await self.redis.zrem(f"{self.redis_users_index_key_prefix}{user_id}", token)
+        await self._invalidate_cached_tokens(token)
 
     async def revoke_all_for_user(self, user_id: "ULID") -> None:
-        cursor = 0
-        keys_to_delete: list[str] = []
-        user_id_str = str(user_id)
-
-        while True:
-            cursor, keys = await self.redis.scan(
-                cursor=cursor, match=f"{self.redis_users_key_prefix}*", count=100
-            )
-            if not keys:
-                if cursor == 0:
-                    break
-                continue
-
-            vals = await self.redis.mget(keys=keys)
-            keys_to_delete.extend([
-                key for key, val in zip(keys, vals, strict=True) if val == user_id_str
-            ])
-
-            if cursor == 0:
-                break
-
-        if keys_to_delete:
-            await self.redis.unlink(*keys_to_delete)
+        tokens = await self.revoke_all_user_tokens(
+            keys=[f"{self.redis_users_index_key_prefix}{user_id}"],
+            args=[self.redis_users_key_prefix],
+        )
+        await self._invalidate_cached_tokens(*tokens)
+        if self.signed_token_strategy is not None:
+            await self.signed_token_strategy.revocation_list.revoke_user(str(user_id))
+
+    async def _invalidate_cached_tokens(self, *tokens: str) -> None:
+        # evict the in-process caches of every worker
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.publish(BEARER_TOKEN_CACHE_NAMESPACE, *tokens)
+
+    async def list_sessions(self, user_id: "ULID") -> list[dict[str, str | datetime | None]]:
+        # signed tokens are not stored anywhere: only the Redis sessions can be listed
+        index_key = f"{self.redis_users_index_key_prefix}{user_id}"
+        now = datetime.now(timezone.utc)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(index_key, "-inf", now.timestamp())
+            pipe.zrange(index_key, 0, -1, withscores=True)
+            _, sessions = await pipe.execute()
+        return [
+            {
+                "token_preview": f"...{token[-4:]}",
+                # tokens without a lifetime are indexed with an infinite score
+                "expires_at": (
+                    None
+                    if math.isinf(expires_at)
+                    else datetime.fromtimestamp(expires_at, tz=timezone.utc)
+                ),
+            }
+            for token, expires_at in sessions
+        ]
@@ -2,6 +2,7 @@ from fastapi_pagination.ext.sqlmodel import apaginate
 from sqlmodel import col, or_, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from fastapi_demo.core.db.replicas import replica_reads
 from fastapi_demo.core.models.users import User
 
 
@@ -35,5 +36,6 @@ class UserService:
             )
         # query_result = await self.session.exec(statement)
         # users = query_result.all()
-        page = await apaginate(self.session, statement.order_by(User.id))  # type: ignore[arg-type]
+        with replica_reads(self.session):
+            page = await apaginate(self.session, statement.order_by(User.id))  # type: ignore[arg-type]
         return page
@@ -0,0 +1,119 @@
+import logging
+import time
+from typing import Literal
+
+from fastapi_demo.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Priority = Literal["critical", "high", "normal"]
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Concurrency limit of the process, adapted to the observed latency with AIMD.
+    - Every request completed within `latency_target_seconds` while the limit was nearly
+      reached adds 1 / limit to it, i.e. the limit grows by about 1 per round of requests.
+      Routes slow by design are measured against their own target.
+    - A slower or failed request multiplies the limit by `backoff_ratio`, at most once per
+      `latency_target_seconds` so that the requests of a single slowdown count once.
+    - The limit stays within [`min_limit`, `max_limit`].
+    """
+
+    def __init__(
+        self,
+        *,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target_seconds: float,
+        backoff_ratio: float,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_seconds = latency_target_seconds
+        self.backoff_ratio = backoff_ratio
+        self._last_decrease = 0.0
+
+    def on_completed(
+        self,
+        latency: float,
+        in_flight: int,
+        *,
+        failed: bool = False,
+        latency_target_seconds: float | None = None,
+    ) -> None:
+        if failed or latency > (latency_target_seconds or self.latency_target_seconds):
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency_target_seconds:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                logger.debug("Concurrency limit decreased to %d", self.limit)
+        elif in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class AdmissionController:
+    """
+    Sheds the requests over the adaptive concurrency limit of the process, rather than letting
+    them queue on the DB and Redis pools until they time out.
+    - "normal" requests are admitted up to the limit, "high" ones (authentication...) up to
+      `high_priority_headroom` above it, and "critical" ones (health checks) always.
+    - Only normal and high priority requests are measured to adapt the limit, and only if
+      they got a response: a request cancelled on a client disconnect says nothing of the load.
+    """
+
+    def __init__(self, limit: AdaptiveConcurrencyLimit, *, high_priority_headroom: float):
+        self.limit = limit
+        self.high_priority_headroom = high_priority_headroom
+        self.in_flight = 0
+        self.rejected: dict[Priority, int] = {"critical": 0, "high": 0, "normal": 0}
+
+    def try_acquire(self, priority: Priority) -> bool:
+        if priority == "normal":
+            admitted = self.in_flight < int(self.limit.limit)
+        elif priority == "high":
+            admitted = self.in_flight < int(self.limit.limit * (1 + self.high_priority_headroom))
+        else:
+            return True
+        if admitted:
+            self.in_flight += 1
+        else:
+            self.rejected[priority] += 1
+        return admitted
+
+    def release(
+        self,
+        latency: float | None,
+        *,
+        failed: bool = False,
+        latency_target_seconds: float | None = None,
+    ) -> None:
+        if latency is not None:
+            self.limit.on_completed(
+                latency,
+                self.in_flight,
+                failed=failed,
+                latency_target_seconds=latency_target_seconds,
+            )
+        self.in_flight -= 1
+
+    def stats(self) -> dict[str, int | dict[Priority, int]]:
+        return {
+            "limit": int(self.limit.limit),
+            "in_flight": self.in_flight,
+            "rejected": dict(self.rejected),
+        }
+
+
+admission_controller = AdmissionController(
+    AdaptiveConcurrencyLimit(
+        initial_limit=settings.ADMISSION_CONTROL_INITIAL_LIMIT,
+        min_limit=settings.ADMISSION_CONTROL_MIN_LIMIT,
+        max_limit=settings.ADMISSION_CONTROL_MAX_LIMIT,
+        latency_target_seconds=settings.ADMISSION_CONTROL_LATENCY_TARGET_SECONDS,
+        backoff_ratio=settings.ADMISSION_CONTROL_BACKOFF_RATIO,
+    ),
+    high_priority_headroom=settings.ADMISSION_CONTROL_HIGH_PRIORITY_HEADROOM,
+)
@@ -0,0 +1,67 @@
+import logging
+import time
+from typing import Literal
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a degraded dependency (Redis, OpenFGA...) after consecutive failures.
+    - "closed": calls go through; `failure_threshold` consecutive failures open the breaker.
+    - "open": calls are skipped for `recovery_seconds`, the caller uses its fallback.
+    - "half_open": a single probe call goes through; it closes the breaker if it succeeds
+      and opens it again if it fails, the other calls keep using the fallback meanwhile.
+    - A probe ending without an outcome (cancelled, or failing for another reason) is given
+      back with `release_probe`, so that the next call probes instead.
+    """
+
+    def __init__(self, name: str, *, failure_threshold: int, recovery_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.times_opened = 0
+        self._probing = False
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.recovery_seconds:
+            return "open"
+        return "half_open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Circuit breaker %r closed", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self) -> None:
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                logger.warning(
+                    "Circuit breaker %r opened after %d failures", self.name, self.failures
+                )
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        self._probing = False
+
+    def stats(self) -> dict[str, str | int]:
+        return {"state": self.state, "failures": self.failures, "times_opened": self.times_opened}
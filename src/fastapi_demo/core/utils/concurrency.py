@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import logging
+import secrets
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: sorted set of the slots (token -> expiry timestamp),
+# ARGV[1]: token, ARGV[2]: limit, ARGV[3]: now, ARGV[4]: slot ttl (seconds)
+ACQUIRE_SLOT_SCRIPT = """
+local now = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(ttl))
+return 1
+"""
+
+
+@dataclass(slots=True)
+class Slots:
+    in_flight: int = 0
+    waiters: deque[asyncio.Future[None]] = field(default_factory=deque)
+
+
+class LocalConcurrencyLimiter:
+    """
+    Caps the in-flight requests of every identity in a single worker.
+    - Requests over the limit wait in a FIFO queue for up to `timeout` seconds, a released
+      slot is handed over to the first waiter.
+    - With W workers, an identity can have up to W times the limit in flight.
+    """
+
+    def __init__(self) -> None:
+        self._slots: dict[str, Slots] = {}
+
+    async def acquire(self, key: str, *, limit: int, timeout: float) -> str | None:
+        slots = self._slots.setdefault(key, Slots())
+        if slots.in_flight < limit:
+            slots.in_flight += 1
+            return key
+        if timeout <= 0:
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        slots.waiters.append(waiter)
+        try:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                # the slot was handed over just before the request was cancelled
+                await self.release(key, key)
+            raise
+        finally:
+            with contextlib.suppress(ValueError):
+                slots.waiters.remove(waiter)
+        if waiter.done():
+            # the slot may also have been handed over while timing out
+            return key
+        waiter.cancel()
+        return None
+
+    async def release(self, key: str, token: str) -> None:  # noqa: ARG002
+        slots = self._slots[key]
+        while slots.waiters:
+            waiter = slots.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        slots.in_flight -= 1
+        if not slots.in_flight:
+            del self._slots[key]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "identities": len(self._slots),
+            "in_flight": sum(slots.in_flight for slots in self._slots.values()),
+            "waiting": sum(len(slots.waiters) for slots in self._slots.values()),
+        }
+
+
+class RedisConcurrencyLimiter:
+    """
+    Caps the in-flight requests of every identity across all the workers.
+    - Every request holds a slot in a Redis sorted set until it completes, or for
+      `slot_ttl_seconds` at most so that the slots of crashed workers are freed.
+    - Requests over the limit poll for a free slot every `poll_interval_seconds`, for up
+      to `timeout` seconds.
+    - Redis calls are bounded by `call_timeout_seconds`; on failure the request is allowed.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        *,
+        slot_ttl_seconds: float,
+        poll_interval_seconds: float,
+        call_timeout_seconds: float,
+        key_prefix: str = "CONCURRENCY:",
+    ):
+        self.redis = redis
+        self.slot_ttl_seconds = slot_ttl_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.call_timeout_seconds = call_timeout_seconds
+        self.key_prefix = key_prefix
+        self.acquire_slot = redis.register_script(ACQUIRE_SLOT_SCRIPT)
+        self.in_flight = 0
+        self.failures = 0
+
+    async def acquire(self, key: str, *, limit: int, timeout: float) -> str | None:
+        token = secrets.token_hex(8)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                acquired = await asyncio.wait_for(
+                    self.acquire_slot(
+                        keys=[f"{self.key_prefix}{key}"],
+                        args=[token, limit, time.time(), self.slot_ttl_seconds],
+                    ),
+                    timeout=self.call_timeout_seconds,
+                )
+            except (RedisError, asyncio.TimeoutError) as exc:
+                logger.warning("Concurrency limiter call failed: %r", exc)
+                self.failures += 1
+                acquired = 1
+            if acquired:
+                self.in_flight += 1
+                return token
+            if time.monotonic() + self.poll_interval_seconds > deadline:
+                return None
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    async def release(self, key: str, token: str) -> None:
+        self.in_flight -= 1
+        try:
+            await asyncio.wait_for(
+                self.redis.zrem(f"{self.key_prefix}{key}", token),
+                timeout=self.call_timeout_seconds,
+            )
+        except (RedisError, asyncio.TimeoutError) as exc:
+            # the slot expires after `slot_ttl_seconds`
+            logger.warning("Failed to release a concurrency slot: %r", exc)
+
+    def stats(self) -> dict[str, int]:
+        return {"in_flight": self.in_flight, "failures": self.failures}
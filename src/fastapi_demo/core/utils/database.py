@@ -4,9 +4,13 @@ from typing import TYPE_CHECKING, cast
 from fastapi_users.exceptions import UserAlreadyExists
 
 from fastapi_demo.core.auth.manager import get_user_manager
+from fastapi_demo.core.auth.redis import invalidation_bus, redis_users_client
 from fastapi_demo.core.config import settings
-from fastapi_demo.core.db.dependencies import get_async_session, get_user_db
-from fastapi_demo.core.db.engine import AsyncSessionMaker
+from fastapi_demo.core.db.dependencies import (
+    get_async_session,
+    get_request_session,
+    get_user_db,
+)
 from fastapi_demo.core.schemas.api_keys import APIKeyCreateRequest
 from fastapi_demo.core.schemas.users import UserCreate
 from fastapi_demo.core.services.api_key import APIKeyService
@@ -16,6 +20,7 @@ if TYPE_CHECKING:
 
 
 get_async_session_context = contextlib.asynccontextmanager(get_async_session)
+get_request_session_context = contextlib.asynccontextmanager(get_request_session)
 get_user_db_context = contextlib.asynccontextmanager(get_user_db)
 get_user_manager_context = contextlib.asynccontextmanager(get_user_manager)
 
@@ -29,7 +34,7 @@ async def create_user(
     is_verified: bool = False,
 ) -> "User":
     try:
-        # Create user
+        # Create the user and its default API key in the same session
         async with get_async_session_context() as session:  # noqa: SIM117
             async with get_user_db_context(session) as user_db:
                 async with get_user_manager_context(user_db) as user_manager:
@@ -44,12 +49,14 @@ async def create_user(
                         )
                     )
                     print(f"User created {user}")
-                    user_id = user.id
-        async with AsyncSessionMaker() as session:
-            api_key_data = await APIKeyService(session, settings).create_api_key(
-                owner_id=user_id, api_key_create=APIKeyCreateRequest(name="default_api_key")
-            )
-            print(api_key_data)
+                    api_key_data = await APIKeyService(
+                        session, settings, redis_users_client, invalidation_bus
+                    ).create_api_key(
+                        owner_id=user.id,
+                        api_key_create=APIKeyCreateRequest(name="default_api_key"),
+                        verify_user=False,
+                    )
+                    print(api_key_data)
     except UserAlreadyExists:
         print(f"User {email} already exists")
         raise
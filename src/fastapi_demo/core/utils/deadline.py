@@ -0,0 +1,60 @@
+import asyncio
+import inspect
+import time
+from collections.abc import Awaitable
+from contextvars import ContextVar, Token
+from typing import TypeVar
+
+T = TypeVar("T")
+
+# monotonic time by which the current request must be answered
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    def __str__(self) -> str:
+        return "The request took too long to complete."
+
+
+def set_deadline(timeout_seconds: float | None) -> Token[float | None]:
+    deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+    return request_deadline.set(deadline)
+
+
+def get_remaining_seconds() -> float | None:
+    """Time left before the deadline of the current request, if it has one"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededError
+    return remaining
+
+
+async def with_deadline(awaitable: Awaitable[T]) -> T:
+    try:
+        remaining = get_remaining_seconds()
+    except DeadlineExceededError:
+        if inspect.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=remaining)
+    except asyncio.TimeoutError as exc:
+        raise DeadlineExceededError from exc
+
+
+class RequestDeadline:
+    """
+    Deadline of a route, overriding `REQUEST_TIMEOUT_SECONDS` from the time its dependencies
+    are solved: `dependencies=[Depends(RequestDeadline(10))]`.
+    """
+
+    def __init__(self, timeout_seconds: float | None):
+        self.timeout_seconds = timeout_seconds
+
+    async def __call__(self) -> None:
+        set_deadline(self.timeout_seconds)
@@ -0,0 +1,11 @@
+from starlette.requests import HTTPConnection
+
+
+def get_client_ip(request: HTTPConnection) -> str:
+    # if behind a load-balancer or an API gateway
+    xff = request.headers.get("x-forwarded-for")
+    if xff:
+        return xff.split(",")[0].strip()
+    if request.client:
+        return request.client.host
+    return "127.0.0.1"
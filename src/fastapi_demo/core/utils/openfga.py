@@ -1,16 +1,44 @@
 import logging
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
-
-from openfga_sdk import ClientConfiguration, CreateStoreRequest, ListStoresResponse, OpenFgaClient
+from typing import Any
+
+from openfga_sdk import (
+    ApiClient,
+    ClientConfiguration,
+    CreateStoreRequest,
+    ListStoresResponse,
+    OpenFgaApi,
+    OpenFgaClient,
+)
 from openfga_sdk.credentials import CredentialConfiguration, Credentials
 
 from fastapi_demo.core.config import settings
+from fastapi_demo.core.utils.deadline import get_remaining_seconds
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class DeadlineApiClient(ApiClient):
+    async def call_api(self, *args: Any, **kwargs: Any) -> Any:
+        if kwargs.get("_request_timeout") is None:
+            # 0 would be the default timeout of the client
+            remaining = get_remaining_seconds()
+            kwargs["_request_timeout"] = remaining and max(remaining, 0.001)
+        return await super().call_api(*args, **kwargs)
+
+
+class DeadlineOpenFgaClient(OpenFgaClient):
+    """OpenFGA client whose calls time out with the deadline of the current request"""
+
+    def __init__(self, configuration: ClientConfiguration):
+        # same as `OpenFgaClient.__init__`, without opening a second HTTP session
+        self._client_configuration = configuration
+        self._api_client = DeadlineApiClient(configuration)
+        self._api = OpenFgaApi(self._api_client)
+
+
 @asynccontextmanager
 async def create_openfga_client(
     api_url: str,
@@ -31,7 +59,7 @@ async def create_openfga_client(
         authorization_model_id=authorization_model_id,
         credentials=credentials,
     )
-    async with OpenFgaClient(configuration) as fga_client:
+    async with DeadlineOpenFgaClient(configuration) as fga_client:
         yield fga_client
 
 
@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import json
+import logging
+from collections import defaultdict
+from collections.abc import AsyncGenerator, Callable
+from contextlib import asynccontextmanager
+from typing import Any
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+InvalidationHandler = Callable[..., None]
+ResetHandler = Callable[[], None]
+
+
+class InvalidationBus:
+    """
+    Broadcast cache invalidations to every worker through a Redis pub/sub channel.
+    - Handlers are registered per namespace and are called with the invalidated keys.
+    - The publishing worker applies the invalidation right away, the others as soon as the
+      message is delivered.
+    - Pub/sub is fire-and-forget: messages sent while a worker is disconnected are lost, so
+      every reset handler is called whenever the subscription is (re)established.
+    - Publishing follows a committed write, so a failure to publish is logged rather than
+      raised: the other workers' caches are then only bounded by their TTL.
+    """
+
+    def __init__(
+        self, redis: aioredis.Redis, channel: str, *, reconnect_delay_seconds: float = 1.0
+    ):
+        self.redis = redis
+        self.channel = channel
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self._handlers: defaultdict[str, list[InvalidationHandler]] = defaultdict(list)
+        self._reset_handlers: list[ResetHandler] = []
+
+    def register(
+        self,
+        namespace: str,
+        handler: InvalidationHandler,
+        *,
+        on_reset: ResetHandler | None = None,
+    ) -> None:
+        self._handlers[namespace].append(handler)
+        if on_reset is not None:
+            self._reset_handlers.append(on_reset)
+
+    async def publish(self, namespace: str, *keys: str) -> None:
+        if not keys:
+            return
+        self._dispatch(namespace, keys)
+        message = json.dumps({"namespace": namespace, "keys": list(keys)})
+        try:
+            await self.redis.publish(self.channel, message)
+        except (RedisError, asyncio.TimeoutError) as exc:
+            logger.warning("Failed to publish the '%s' invalidations: %r", namespace, exc)
+
+    def _dispatch(self, namespace: str, keys: Any) -> None:
+        for handler in self._handlers.get(namespace, ()):
+            handler(*keys)
+
+    def _reset(self) -> None:
+        for reset in self._reset_handlers:
+            reset()
+
+    def _handle_message(self, data: str | bytes) -> None:
+        try:
+            payload = json.loads(data)
+            self._dispatch(payload["namespace"], payload["keys"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed invalidation message on '{self.channel}'")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    self._reset()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._handle_message(message["data"])
+            except asyncio.CancelledError:  # noqa: PERF203
+                raise
+            except Exception:
+                logger.exception(f"Lost the subscription to '{self.channel}', reconnecting")
+                self._reset()
+                await asyncio.sleep(self.reconnect_delay_seconds)
+
+    @asynccontextmanager
+    async def listening(self) -> AsyncGenerator[None]:
+        task = asyncio.create_task(self._listen())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
@@ -0,0 +1,581 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import AsyncGenerator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Literal, NamedTuple
+
+import redis.asyncio as aioredis
+from limits import RateLimitItem
+from redis.exceptions import RedisError
+
+from fastapi_demo.core.utils.cache import LocalTTLCache
+from fastapi_demo.core.utils.circuit_breaker import CircuitBreaker
+from fastapi_demo.core.utils.deadline import DeadlineExceededError
+
+logger = logging.getLogger(__name__)
+
+# Every script works in one of two modes on all the windows of a request:
+# - "hit": every window is hit with the cost independently of the others;
+# - "acquire": at most the cost is taken from every window, as much as all of them allow.
+# They return the granted cost, then for every window in order whether it allowed the hit,
+# the remaining hits and the milliseconds until its reset.
+# The windows are stored under the same keys as with the `limits` library.
+
+# KEYS[i]: window counter, ARGV[1]: mode, ARGV[2]: cost,
+# ARGV[2i+1], ARGV[2i+2]: limit and expiry (seconds)
+FIXED_WINDOW_SCRIPT = """
+local acquire = ARGV[1] == 'acquire'
+local cost = tonumber(ARGV[2])
+if acquire then
+    for i, key in ipairs(KEYS) do
+        local current = tonumber(redis.call('GET', key)) or 0
+        cost = math.max(0, math.min(cost, tonumber(ARGV[2 * i + 1]) - current))
+    end
+end
+local result = {cost}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 * i + 1])
+    local expiry = tonumber(ARGV[2 * i + 2])
+    local current = tonumber(redis.call('GET', key)) or 0
+    if cost > 0 then
+        current = redis.call('INCRBY', key, cost)
+        if current == cost then
+            redis.call('EXPIRE', key, expiry)
+        end
+    end
+    local ttl = redis.call('PTTL', key)
+    table.insert(result, (cost > 0 and current <= limit) and 1 or 0)
+    table.insert(result, math.max(0, limit - current))
+    table.insert(result, math.max(0, ttl))
+end
+return result
+"""
+
+# KEYS[i]: window entries, ARGV[1]: mode, ARGV[2]: cost, ARGV[3]: timestamp (seconds),
+# ARGV[2i+2], ARGV[2i+3]: limit and expiry (seconds)
+MOVING_WINDOW_SCRIPT = """
+local acquire = ARGV[1] == 'acquire'
+local cost = tonumber(ARGV[2])
+local timestamp = tonumber(ARGV[3])
+
+-- index of the oldest entry still in the window, entries are pushed on the left
+local function oldest_index(key, limit, expiry)
+    local low, high, index = 0, limit - 1, nil
+    while low <= high do
+        local mid = math.floor((low + high) / 2)
+        local value = tonumber(redis.call('LINDEX', key, mid))
+        if value and value >= timestamp - expiry then
+            index = mid
+            low = mid + 1
+        else
+            high = mid - 1
+        end
+    end
+    return index
+end
+
+local function push(key, limit, expiry, amount)
+    for _ = 1, amount do
+        redis.call('LPUSH', key, ARGV[3])
+    end
+    redis.call('LTRIM', key, 0, limit - 1)
+    redis.call('EXPIRE', key, expiry)
+end
+
+if acquire then
+    for i, key in ipairs(KEYS) do
+        local limit = tonumber(ARGV[2 * i + 2])
+        local index = oldest_index(key, limit, tonumber(ARGV[2 * i + 3]))
+        cost = math.max(0, math.min(cost, limit - (index and index + 1 or 0)))
+    end
+end
+local result = {cost}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 * i + 2])
+    local expiry = tonumber(ARGV[2 * i + 3])
+
+    local allowed = 0
+    if acquire then
+        if cost > 0 then
+            push(key, limit, expiry, cost)
+            allowed = 1
+        end
+    elseif cost <= limit then
+        local entry = redis.call('LINDEX', key, limit - cost)
+        if not entry or tonumber(entry) < timestamp - expiry then
+            push(key, limit, expiry, cost)
+            allowed = 1
+        end
+    end
+
+    local index = oldest_index(key, limit, expiry)
+    table.insert(result, allowed)
+    if index then
+        local oldest = tonumber(redis.call('LINDEX', key, index))
+        table.insert(result, math.max(0, limit - index - 1))
+        table.insert(result, math.max(0, math.floor((oldest + expiry - timestamp) * 1000)))
+    else
+        table.insert(result, limit)
+        table.insert(result, 0)
+    end
+end
+return result
+"""
+
+# KEYS[2i-1], KEYS[2i]: previous and current window counters, ARGV[1]: mode, ARGV[2]: cost,
+# ARGV[2i+1], ARGV[2i+2]: limit and expiry (seconds)
+SLIDING_WINDOW_COUNTER_SCRIPT = """
+local acquire = ARGV[1] == 'acquire'
+local cost = tonumber(ARGV[2])
+local windows = {}
+for i = 1, #KEYS / 2 do
+    local previous_key = KEYS[2 * i - 1]
+    local current_key = KEYS[2 * i]
+    local expiry = tonumber(ARGV[2 * i + 2]) * 1000
+
+    local current_ttl = tonumber(redis.call('PTTL', current_key))
+    if current_ttl > 0 and current_ttl < expiry then
+        -- the current window is over, it becomes the previous one
+        redis.call('RENAME', current_key, previous_key)
+        redis.call('SET', current_key, 0, 'PX', current_ttl + expiry)
+    end
+
+    local previous_count = tonumber(redis.call('GET', previous_key)) or 0
+    local previous_ttl = math.max(0, tonumber(redis.call('PTTL', previous_key)))
+    local window = {
+        limit = tonumber(ARGV[2 * i + 1]),
+        expiry = expiry,
+        previous_count = previous_count,
+        previous_ttl = previous_ttl,
+        current_count = tonumber(redis.call('GET', current_key)) or 0,
+        current_ttl = math.max(0, tonumber(redis.call('PTTL', current_key))),
+    }
+    window.weighted_count = math.floor(previous_count * previous_ttl / expiry)
+        + window.current_count
+    windows[i] = window
+    if acquire then
+        cost = math.max(0, math.min(cost, window.limit - window.weighted_count))
+    end
+end
+
+local result = {cost}
+for i, window in ipairs(windows) do
+    local current_key = KEYS[2 * i]
+    local allowed = 0
+    if cost > 0 and (acquire or window.weighted_count + cost <= window.limit) then
+        if redis.call('EXISTS', current_key) == 1 then
+            redis.call('INCRBY', current_key, cost)
+        else
+            redis.call('SET', current_key, cost, 'PX', window.expiry * 2)
+            window.current_ttl = window.expiry * 2
+        end
+        window.current_count = window.current_count + cost
+        window.weighted_count = window.weighted_count + cost
+        allowed = 1
+    end
+
+    local reset = nil
+    if window.previous_count > 0 then
+        reset = window.previous_ttl % (window.expiry / window.previous_count)
+    end
+    if window.current_count > 0 then
+        local current_reset = window.current_ttl % window.expiry
+        if current_reset == 0 then
+            current_reset = window.expiry
+        end
+        if not reset or current_reset < reset then
+            reset = current_reset
+        end
+    end
+
+    table.insert(result, allowed)
+    table.insert(result, math.max(0, window.limit - window.weighted_count))
+    table.insert(result, math.floor(reset or 0))
+end
+return result
+"""
+
+# Give back hits taken but not used, without going below zero, to the windows they were taken
+# from. A counter is one of them if its TTL then, its current TTL plus the time elapsed since,
+# is in the range of TTLs of the windows current then: a window started since has a longer
+# one. Hits of windows expired since are not given back.
+# KEYS[i]: window counter, ARGV[1]: amount, ARGV[2]: milliseconds since the hits were taken,
+# ARGV[2i+1], ARGV[2i+2]: exclusive minimum and maximum TTL (milliseconds) of a current window
+RELEASE_COUNTERS_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local elapsed = tonumber(ARGV[2])
+for i, key in ipairs(KEYS) do
+    local ttl = tonumber(redis.call('PTTL', key))
+    local acquired_ttl = ttl + elapsed
+    if ttl > 0 and acquired_ttl > tonumber(ARGV[2 * i + 1])
+        and acquired_ttl <= tonumber(ARGV[2 * i + 2]) then
+        local current = tonumber(redis.call('GET', key)) or 0
+        if current > 0 then
+            redis.call('DECRBY', key, math.min(current, amount))
+        end
+    end
+end
+"""
+
+# the margin for the round-trip of an acquisition: a window started within it after the hits
+# were taken could be mistaken for theirs
+RELEASE_LATENCY_MS = 100
+
+# KEYS[i]: window entries, ARGV[1]: amount, ARGV[2]: timestamp of the entries
+RELEASE_ENTRIES_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    redis.call('LREM', key, tonumber(ARGV[1]), ARGV[2])
+end
+"""
+
+
+class WindowHit(NamedTuple):
+    allowed: bool
+    remaining: int
+    reset_time: float
+
+
+class RateLimitEngine:
+    """
+    Hit several rate limits (e.g. burst and sustained) of an identifier in a single Redis
+    round-trip, and get the stats of every window along with the result.
+    - Same semantics and same keys as the `limits` strategies of the same name: every window
+      is hit independently of the others, and both can be used in turn on a live system.
+    - Hits can also be acquired in bulk and given back, see `LeasedRateLimiter`.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        strategy: Literal["sliding-window-counter", "fixed-window", "moving-window"],
+        key_prefix: str = "LIMITS",
+    ):
+        self.redis = redis
+        self.strategy = strategy
+        self.key_prefix = key_prefix
+        script = {
+            "fixed-window": FIXED_WINDOW_SCRIPT,
+            "moving-window": MOVING_WINDOW_SCRIPT,
+            "sliding-window-counter": SLIDING_WINDOW_COUNTER_SCRIPT,
+        }[strategy]
+        self.script = redis.register_script(script)
+        self.release_counters = redis.register_script(RELEASE_COUNTERS_SCRIPT)
+        self.release_entries = redis.register_script(RELEASE_ENTRIES_SCRIPT)
+
+    def _keys(self, item: RateLimitItem, identifiers: Sequence[str]) -> list[str]:
+        key = item.key_for(*identifiers)
+        if self.strategy == "sliding-window-counter":
+            # braces keep both windows on the same node of a cluster
+            return [f"{self.key_prefix}:{{{key}}}/-1", f"{self.key_prefix}:{{{key}}}"]
+        return [f"{self.key_prefix}:{key}"]
+
+    async def _run(
+        self,
+        mode: Literal["hit", "acquire"],
+        items: Sequence[RateLimitItem],
+        identifiers: Sequence[str],
+        cost: int,
+        now: float,
+    ) -> tuple[int, list[WindowHit]]:
+        keys = [key for item in items for key in self._keys(item, identifiers)]
+        args: list[str | float] = [mode, cost]
+        if self.strategy == "moving-window":
+            args.append(now)
+        for item in items:
+            args.extend((item.amount, item.get_expiry()))
+
+        granted, *result = await self.script(keys=keys, args=args)
+        windows = [
+            WindowHit(
+                allowed=bool(result[i]),
+                remaining=int(result[i + 1]),
+                reset_time=now + int(result[i + 2]) / 1000,
+            )
+            for i in range(0, len(result), 3)
+        ]
+        return int(granted), windows
+
+    async def hit(
+        self, items: Sequence[RateLimitItem], *identifiers: str, cost: int = 1
+    ) -> list[WindowHit]:
+        _, windows = await self._run("hit", items, identifiers, cost, time.time())
+        return windows
+
+    async def acquire(
+        self, items: Sequence[RateLimitItem], *identifiers: str, cost: int, now: float
+    ) -> tuple[int, list[WindowHit]]:
+        """Take up to `cost` hits from all the windows, as many as all of them allow"""
+        return await self._run("acquire", items, identifiers, cost, now)
+
+    async def release(
+        self, items: Sequence[RateLimitItem], *identifiers: str, amount: int, acquired_at: float
+    ) -> None:
+        """Give back hits acquired at `acquired_at` and not used"""
+        if self.strategy == "moving-window":
+            keys = [key for item in items for key in self._keys(item, identifiers)]
+            await self.release_entries(keys=keys, args=[amount, acquired_at])
+        else:
+            keys = []
+            elapsed = (time.time() - acquired_at) * 1000 - RELEASE_LATENCY_MS
+            args: list[int] = [amount, max(0, int(elapsed))]
+            for item in items:
+                expiry = item.get_expiry() * 1000
+                # a sliding window counter is current for its first `expiry`, then previous
+                ttl_range = (expiry, 2 * expiry) if self.strategy != "fixed-window" else (0, expiry)
+                for key in self._keys(item, identifiers):
+                    keys.append(key)
+                    args.extend(ttl_range)
+            await self.release_counters(keys=keys, args=args)
+
+
+@dataclass(slots=True)
+class Lease:
+    items: Sequence[RateLimitItem]
+    identifiers: Sequence[str]
+    remaining: int
+    windows: list[WindowHit]
+    acquired_at: float
+    expires_at: float
+    # fixed windows: the hits can't be given back once their window is over
+    releasable_until: float
+    # no hit left: the requests are rejected until the lease expires
+    denied: bool = False
+
+
+class LeasedRateLimiter:
+    """
+    Approximate mode of `RateLimitEngine`: every worker takes the hits of an identifier from
+    Redis in leases of up to `lease_size`, and serves them from memory until the lease is
+    used up or `lease_ttl_seconds` old. The unused hits of expired leases are given back.
+    Per identifier and per window, with W workers and L = `lease_size`:
+    - up to W x (L - 1) hits can be rejected too early, while held by the other workers;
+    - up to W x (L - 1) hits can be allowed over the limit with the sliding and moving
+      windows, as a leased hit is counted when it's taken and can be used up to
+      `lease_ttl_seconds` later. Fixed window leases end with their window.
+    - once a window is exhausted, the worker rejects locally until a hit is freed in it or
+      for `lease_ttl_seconds` at most.
+    A `lease_size` of 1 is the exact mode, with a Redis call per request.
+    """
+
+    def __init__(
+        self,
+        engine: RateLimitEngine,
+        *,
+        lease_size: int,
+        lease_ttl_seconds: float,
+        max_leases: int,
+    ):
+        self.engine = engine
+        self.lease_size = lease_size
+        self.lease_ttl_seconds = lease_ttl_seconds
+        self.max_leases = max_leases
+        self._leases: dict[tuple[str, ...], Lease] = {}
+
+    async def hit(
+        self, items: Sequence[RateLimitItem], *identifiers: str, cost: int = 1
+    ) -> list[WindowHit]:
+        key = tuple(item.key_for(*identifiers) for item in items)
+        now = time.time()
+        lease = self._leases.get(key)
+        if lease is not None and lease.expires_at > now:
+            if lease.remaining >= cost:
+                lease.remaining -= cost
+                return [
+                    window._replace(remaining=window.remaining + lease.remaining)
+                    for window in lease.windows
+                ]
+            if lease.denied:
+                return lease.windows
+        if lease is not None:
+            del self._leases[key]
+            await self._release(lease, now)
+
+        lease_size = self.lease_size if len(self._leases) < self.max_leases else 1
+        granted, windows = await self.engine.acquire(
+            items, *identifiers, cost=max(cost, lease_size), now=now
+        )
+        if granted < cost:
+            if granted:
+                await self.engine.release(items, *identifiers, amount=granted, acquired_at=now)
+            windows = [window._replace(allowed=False) for window in windows]
+            # reject locally until a hit is freed in the exhausted windows
+            reset_time = min(window.reset_time for window in windows if window.remaining < cost)
+            self._leases[key] = Lease(
+                items,
+                identifiers,
+                remaining=0,
+                windows=windows,
+                acquired_at=now,
+                expires_at=min(now + self.lease_ttl_seconds, reset_time),
+                releasable_until=now,
+                denied=True,
+            )
+            return windows
+
+        if granted > cost:
+            expires_at = now + self.lease_ttl_seconds
+            releasable_until = float("inf")
+            if self.engine.strategy == "fixed-window":
+                releasable_until = min(window.reset_time for window in windows)
+                expires_at = min(expires_at, releasable_until)
+            lease = Lease(
+                items, identifiers, granted - cost, windows, now, expires_at, releasable_until
+            )
+            if key in self._leases:
+                # another lease was taken concurrently for the same identifier
+                await self._release(lease, now)
+            else:
+                self._leases[key] = lease
+        return [window._replace(remaining=window.remaining + granted - cost) for window in windows]
+
+    async def _release(self, lease: Lease, now: float) -> None:
+        if lease.remaining and lease.releasable_until > now:
+            try:
+                await self.engine.release(
+                    lease.items,
+                    *lease.identifiers,
+                    amount=lease.remaining,
+                    acquired_at=lease.acquired_at,
+                )
+            except Exception:
+                logger.exception("Failed to give back the unused hits of a rate limit lease")
+
+    async def release_expired(self, *, all_leases: bool = False) -> None:
+        now = time.time()
+        expired = [
+            key for key, lease in self._leases.items() if all_leases or lease.expires_at <= now
+        ]
+        for key in expired:
+            await self._release(self._leases.pop(key), now)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl_seconds)
+            await self.release_expired()
+
+    def stats(self) -> dict[str, int]:
+        return {"leases": len(self._leases)}
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator[None]:
+        task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            await self.release_expired(all_leases=True)
+
+
+class LocalRateLimiter:
+    """
+    In-process fixed window limiter of a single worker, the fallback while Redis is out.
+    - With W workers, up to W times the limits are allowed overall.
+    - The counters are kept in a bounded LRU cache until their window ends.
+    """
+
+    def __init__(self, max_keys: int):
+        self._counters: LocalTTLCache[str, int] = LocalTTLCache(maxsize=max_keys, ttl_seconds=0)
+
+    async def hit(
+        self, items: Sequence[RateLimitItem], *identifiers: str, cost: int = 1
+    ) -> list[WindowHit]:
+        now = time.time()
+        windows = []
+        for item in items:
+            expiry = item.get_expiry()
+            window_start = now - now % expiry
+            key = f"{item.key_for(*identifiers)}/{int(window_start)}"
+            current = self._counters.get(key) or 0
+            windows.append((item, key, current, window_start + expiry))
+        allowed = all(current + cost <= item.amount for item, _, current, _ in windows)
+        hits = []
+        for item, key, current, reset_time in windows:
+            count = current + cost if allowed else current
+            if allowed:
+                self._counters.set(key, count, ttl_seconds=reset_time - now)
+            hits.append(WindowHit(allowed, max(0, item.amount - count), reset_time))
+        return hits
+
+
+class ResilientRateLimiter:
+    """
+    Bounds the time spent on the rate limiter's Redis calls, so that a Redis brownout
+    doesn't stall every request.
+    - Every call has `timeout_seconds` to complete; timeouts and Redis errors count as
+      failures of the circuit breaker.
+    - While the call fails or the breaker is open, `on_failure` decides: "local" limits
+      with the in-process `fallback`, "open" allows the request and "closed" rejects it.
+    - A call timing out, or whose request is cancelled, is left to complete in the
+      background: its script may have already run in Redis, the hits it took must still
+      reach the lease of a `LeasedRateLimiter`.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimitEngine | LeasedRateLimiter,
+        *,
+        fallback: LocalRateLimiter,
+        breaker: CircuitBreaker,
+        timeout_seconds: float,
+    ):
+        self.limiter = limiter
+        self.fallback = fallback
+        self.breaker = breaker
+        self.timeout_seconds = timeout_seconds
+        self.counters = {"timeouts": 0, "errors": 0, "local": 0, "open": 0, "closed": 0}
+        self._late_calls: set[asyncio.Task[list[WindowHit]]] = set()
+
+    def _on_late_call_done(self, task: asyncio.Task[list[WindowHit]]) -> None:
+        self._late_calls.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Late rate limiter call failed: %r", task.exception())
+
+    async def hit(
+        self,
+        items: Sequence[RateLimitItem],
+        *identifiers: str,
+        cost: int = 1,
+        on_failure: Literal["local", "open", "closed"] = "local",
+    ) -> list[WindowHit]:
+        probe = self.breaker.state == "half_open"
+        if self.breaker.allow_request():
+            call = asyncio.create_task(self.limiter.hit(items, *identifiers, cost=cost))
+            try:
+                windows = await asyncio.wait_for(asyncio.shield(call), timeout=self.timeout_seconds)
+            except DeadlineExceededError:
+                # the request is over, not Redis: neither a success nor a failure
+                raise
+            except asyncio.TimeoutError:
+                self.counters["timeouts"] += 1
+                self.breaker.record_failure()
+            except RedisError as exc:
+                logger.warning("Rate limiter call failed: %r", exc)
+                self.counters["errors"] += 1
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+                return windows
+            finally:
+                if not call.done():
+                    self._late_calls.add(call)
+                    call.add_done_callback(self._on_late_call_done)
+                if probe:
+                    # cancelled or failing otherwise, the probe tells nothing about Redis
+                    self.breaker.release_probe()
+
+        self.counters[on_failure] += 1
+        if on_failure == "local":
+            return await self.fallback.hit(items, *identifiers, cost=cost)
+        reset_time = time.time() + self.breaker.recovery_seconds
+        return [
+            WindowHit(allowed=on_failure == "open", remaining=0, reset_time=reset_time)
+            for _ in items
+        ]
+
+    def stats(self) -> dict[str, Any]:
+        return {"breaker": self.breaker.stats(), "fallbacks": dict(self.counters)}
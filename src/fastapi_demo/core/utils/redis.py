@@ -0,0 +1,122 @@
+import logging
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.connection import BlockingConnectionPool
+
+from fastapi_demo.core.config import settings
+from fastapi_demo.core.utils.deadline import with_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlinePipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True) -> list[Any]:
+        return await with_deadline(super().execute(raise_on_error))
+
+
+class DeadlineRedis(aioredis.Redis):
+    """
+    Redis client whose commands and pipelines fail with `DeadlineExceededError` once the
+    deadline of the current request is over, instead of waiting for the socket timeout.
+    """
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        return await with_deadline(super().execute_command(*args, **options))
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return DeadlinePipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class RedisPoolRegistry:
+    """
+    One named connection pool per Redis use (users, rate limiting...), shared by every
+    client of the process.
+    - Pools are created on first use and don't connect until a command is sent, so clients
+      can be built at import time; the lifespan closes them on shutdown.
+    - A client waits up to `timeout` seconds for a connection once `max_connections` are
+      in use, instead of opening more.
+    - Idle connections are checked with a PING after `health_check_interval` seconds.
+    - `options` override the defaults of a pool, e.g. no `socket_timeout` for pub/sub.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        max_connections: int,
+        timeout: float,
+        health_check_interval: float,
+        socket_timeout: float | None,
+        socket_connect_timeout: float | None,
+        password: str | None = None,
+    ):
+        self.url = url
+        self.pool_options: dict[str, Any] = {
+            "max_connections": max_connections,
+            "timeout": timeout,
+            "health_check_interval": health_check_interval,
+            "socket_timeout": socket_timeout,
+            "socket_connect_timeout": socket_connect_timeout,
+            "password": password,
+        }
+        self._pools: dict[str, BlockingConnectionPool] = {}
+
+    def pool(
+        self, name: str, *, db: int, decode_responses: bool = True, **options: Any
+    ) -> BlockingConnectionPool:
+        if name not in self._pools:
+            self._pools[name] = BlockingConnectionPool.from_url(
+                self.url,
+                db=db,
+                decode_responses=decode_responses,
+                **{**self.pool_options, **options},
+            )
+        return self._pools[name]
+
+    def client(
+        self, name: str, *, db: int, decode_responses: bool = True, **options: Any
+    ) -> aioredis.Redis:
+        return DeadlineRedis(
+            connection_pool=self.pool(name, db=db, decode_responses=decode_responses, **options)
+        )
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            name: {
+                "max_connections": pool.max_connections,
+                "in_use": len(pool._in_use_connections),
+                "idle": len(pool._available_connections),
+            }
+            for name, pool in self._pools.items()
+        }
+
+    async def close(self) -> None:
+        for name, pool in self._pools.items():
+            try:
+                await pool.disconnect()
+            except Exception:  # noqa: PERF203
+                logger.exception("Failed to close the Redis pool %r", name)
+
+    @asynccontextmanager
+    async def managed(self) -> AsyncGenerator[None]:
+        try:
+            yield
+        finally:
+            await self.close()
+
+
+redis_pools = RedisPoolRegistry(
+    str(settings.REDIS_URI),
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+    socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+    password=settings.REDIS_PASSWORD,
+)
@@ -4,10 +4,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import ORJSONResponse, Response
 from fastapi_pagination import add_pagination
 
-from fastapi_demo.api.dependencies import rate_limit_dep
 from fastapi_demo.api.exception_handlers import add_exception_handlers
 from fastapi_demo.api.lifespan import lifespan
 from fastapi_demo.api.main import api_router
+from fastapi_demo.api.middleware import add_middlewares
+from fastapi_demo.api.ratelimit import no_rate_limit
 from fastapi_demo.api.routes import health
 from fastapi_demo.core.config import settings
 from fastapi_demo.core.utils.identifiers import custom_generate_unique_id
@@ -16,26 +17,24 @@ from fastapi_demo.core.utils.identifiers import custom_generate_unique_id
 def create_app(
     default_response_class: type[Response] = ORJSONResponse,
 ) -> FastAPI:
-    kwargs = {"dependencies": None}
-    if settings.RATE_LIMITING_ENABLED:
-        kwargs["dependencies"] = [Depends(rate_limit_dep)]  # type: ignore[assignment]
-
     app = FastAPI(
         title=settings.PROJECT_NAME,
         openapi_url=f"{settings.API_PREFIX}/openapi.json",
         generate_unique_id_function=custom_generate_unique_id,
         default_response_class=default_response_class,
         lifespan=lifespan,
-        **kwargs,  # type: ignore[arg-type]
     )
     add_pagination(app)
 
-    # add_middlewares(
-    #     app,
-    #     default_response_class=default_response_class,
-    #     enable_rate_limit=settings.RATE_LIMITING_ENABLED,
-    #     enable_rate_limit_headers=settings.RATE_LIMITING_HEADERS_ENABLED,
-    # )
+    add_middlewares(
+        app,
+        default_response_class=default_response_class,
+        enable_rate_limit=settings.RATE_LIMITING_ENABLED,
+        enable_rate_limit_headers=settings.RATE_LIMITING_HEADERS_ENABLED,
+        enable_concurrency_limit=settings.CONCURRENCY_LIMITING_ENABLED,
+        enable_admission_control=settings.ADMISSION_CONTROL_ENABLED,
+        enable_disconnect_cancellation=settings.CANCEL_ON_DISCONNECT_ENABLED,
+    )
 
     if settings.all_cors_origins:
         app.add_middleware(
@@ -49,7 +48,12 @@ def create_app(
     add_exception_handlers(app, default_response_class)
 
     app.include_router(api_router, prefix=f"{settings.API_PREFIX}")
-    app.include_router(health.router, prefix="/healthz", tags=["health"])
+    app.include_router(
+        health.router,
+        prefix="/healthz",
+        tags=["health"],
+        dependencies=[Depends(no_rate_limit)],
+    )
 
     return app
 